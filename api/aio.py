@@ -0,0 +1,435 @@
+"""Asyncio server mode of the API
+
+Serves the routes of ``run.py`` from a single aiohttp process, for
+deployments with many concurrent pushers. Bearer tokens are validated with
+a non-blocking GraphQL call to OpenCTI and cached like in the Flask mode,
+and answered with 503 while OpenCTI can not be reached.
+Spool appends, uploads and the pycti queries behind the read routes run in
+a thread pool, so a slow disk or a slow OpenCTI never blocks the event
+loop, and a long poll of /sync-data only holds a coroutine.
+
+Requires aiohttp. Run with ``python aio.py``.
+"""
+
+import asyncio
+import io
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+from werkzeug.datastructures import MultiDict
+
+from run import (
+    PUSHES_REFUSED,
+    REQUESTS,
+    REQUEST_SECONDS,
+    SYNC_MAX_WAIT,
+    SYNC_POLL_INTERVAL,
+    api_config,
+    authCaches,
+    backpressure,
+    buildFilters,
+    buildPagination,
+    clients,
+    config,
+    exportObservables,
+    ingestUpload,
+    listObservables,
+    project,
+    pushRecords,
+    responses,
+    syncPage,
+    uploadStream,
+)
+from cache import cache_key
+from clients import TOKEN_QUERY, OpenCTIUnavailable, token_status
+from limits import PushLimits
+from metrics import REGISTRY
+from export import EXPORT_FORMATS
+from sync import advance, decode_sync_token, encode_sync_token, filters_fingerprint
+
+__all__ = [
+    "TokenValidator",
+    "create_app",
+]
+
+class TokenValidator:
+    """Non-blocking validation of bearer tokens, with a TTL cache"""
+
+    def __init__(self, url: str, ttl: int = 300, negative_ttl: int = 30, capacity: int = 256):
+        """
+        :param url: Url of the OpenCTI platform
+        :param ttl: Seconds a validated token is trusted without asking OpenCTI again
+        :param negative_ttl: Seconds a rejected token is refused without asking OpenCTI again
+        :param capacity: Maximum number of tokens remembered
+        """
+        self._url = f"{url}/graphql"
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._capacity = capacity
+        self._entries: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._session = None
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+
+    async def close(self) -> None:
+        await self._session.close()
+
+    async def _check(self, token: str) -> Optional[bool]:
+        try:
+            async with self._session.post(
+                self._url,
+                json={"query": TOKEN_QUERY},
+                headers={"Authorization": f"Bearer {token}"},
+            ) as response:
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    body = None
+                return token_status(response.status, body)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    async def _validate(self, token: str) -> bool:
+        try:
+            valid = await self._check(token)
+        finally:
+            del self._pending[token]
+        # Only a token OpenCTI rejected is remembered, an outage is not
+        if valid is None:
+            raise OpenCTIUnavailable("OpenCTI can not validate the token")
+        ttl = self._ttl if valid else self._negative_ttl
+        self._entries[token] = (valid, time.monotonic() + ttl)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+        return valid
+
+    async def is_valid(self, token: str) -> bool:
+        """Check a bearer token, asking OpenCTI only if it is not cached
+        :param token: Bearer token of the request
+        :return: True if OpenCTI accepts the token
+        :raises OpenCTIUnavailable: OpenCTI can not be reached, nothing is cached
+        """
+        entry = self._entries.get(token)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(token)
+            return entry[0]
+        self.misses += 1
+        # Concurrent requests with the same new token validate it only once
+        task = self._pending.get(token)
+        if task is None:
+            task = self._pending[token] = asyncio.ensure_future(self._validate(token))
+        return await asyncio.shield(task)
+
+
+class _BodyReader(io.RawIOBase):
+    """Blocking view of a request body, read from a worker thread"""
+
+    def __init__(self, content: aiohttp.StreamReader, loop: asyncio.AbstractEventLoop):
+        self._content = content
+        self._loop = loop
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = asyncio.run_coroutine_threadsafe(
+            self._content.read(len(buffer)), self._loop
+        ).result()
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def _message(message: str, status: int) -> web.Response:
+    return web.json_response({'message': message}, status=status)
+
+
+def _token(request: web.Request):
+    header = request.headers.get('authorization', '').split(" ")
+    if len(header) != 2 or header[0] != "Bearer":
+        return None
+    return header[1]
+
+
+@web.middleware
+async def observe_request(request: web.Request, handler):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exp:
+        status = exp.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+        REQUESTS.inc(route=route, method=request.method, status=status)
+
+
+@web.middleware
+async def auth_required(request: web.Request, handler):
+    if request.path == '/metrics':
+        return await handler(request)
+    token = _token(request)
+    try:
+        valid = bool(token) and await request.app['validator'].is_valid(token)
+    except OpenCTIUnavailable:
+        return _message("OpenCTI is unavailable, retry later!", 503)
+    if not valid:
+        return _message("unauthorized!", 401)
+    request['token'] = token
+    return await handler(request)
+
+
+async def _run(request: web.Request, function, *args):
+    return await asyncio.get_running_loop().run_in_executor(request.app['executor'], function, *args)
+
+
+async def _client(request: web.Request):
+    try:
+        client = await _run(request, clients.get, request['token'])
+    except OpenCTIUnavailable:
+        raise web.HTTPServiceUnavailable(
+            text=json.dumps({'message': "OpenCTI is unavailable, retry later!"}), content_type='application/json'
+        )
+    if client is None:
+        raise web.HTTPUnauthorized(
+            text=json.dumps({'message': "unauthorized!"}), content_type='application/json'
+        )
+    return client
+
+
+async def _ingest(request: web.Request, stream, args_param, mimetype, filename=None, limits=None) -> web.Response:
+    body, status = await _run(
+        request, ingestUpload, request['token'], stream, args_param, mimetype, filename, limits
+    )
+    return web.json_response(body, status=status)
+
+
+async def _admission(request: web.Request):
+    retry_after = await _run(request, backpressure.retry_after, request['token'])
+    if retry_after is None:
+        return None
+    PUSHES_REFUSED.inc(reason="backpressure")
+    return web.json_response(
+        {'message': "spool is full, retry later!"},
+        status=429,
+        headers={'Retry-After': str(retry_after)},
+    )
+
+
+def _body(request: web.Request):
+    return io.BufferedReader(_BodyReader(request.content, asyncio.get_running_loop()))
+
+
+async def _ingest_body(request: web.Request, limits=None) -> web.Response:
+    try:
+        stream = uploadStream(_body(request), request.headers.get('Content-Encoding'))
+    except ValueError:
+        return _message("unsupported content encoding!", 415)
+    return await _ingest(request, stream, MultiDict(request.query.items()), request.content_type, limits=limits)
+
+
+async def push_data(request: web.Request) -> web.Response:
+    try:
+        refused = await _admission(request)
+        if refused is not None:
+            return refused
+        if request.content_type != "application/json":
+            return await _ingest_body(request, PushLimits.from_config(api_config, request['token']))
+        body, status = await _run(
+            request,
+            pushRecords,
+            request['token'],
+            _body(request),
+            request.headers.get('Content-Encoding'),
+            request.content_length,
+        )
+        return web.json_response(body, status=status)
+    except Exception:
+        return _message("failed!", 500)
+
+
+async def push_file_data(request: web.Request) -> web.Response:
+    try:
+        refused = await _admission(request)
+        if refused is not None:
+            return refused
+        if request.content_type not in ("multipart/form-data", "application/x-www-form-urlencoded"):
+            return await _ingest_body(request)
+        form = await request.post()
+        args_param = MultiDict(list(request.query.items()) + [
+            (key, value) for key, value in form.items() if isinstance(value, str)
+        ])
+        upload = form.get('file-data')
+        if upload is None or isinstance(upload, str):
+            return _message("missing file-data!", 400)
+        return await _ingest(request, uploadStream(upload.file), args_param, upload.content_type, upload.filename)
+    except Exception:
+        return _message("failed!", 500)
+
+
+def _not_modified(request: web.Request, entry) -> bool:
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = [tag.strip() for tag in if_none_match.split(',')]
+        etags = [tag[2:] if tag.startswith('W/') else tag for tag in etags]
+        return '*' in etags or f'"{entry.etag}"' in etags
+    if_modified_since = request.if_modified_since
+    return if_modified_since is not None and int(entry.last_modified) <= if_modified_since.timestamp()
+
+
+async def get_data(request: web.Request) -> web.Response:
+    try:
+        search_data, param = buildFilters(request.query)
+        after, first, fields = buildPagination(request.query)
+    except ValueError as exp:
+        return _message(str(exp), 400)
+
+    try:
+        key = cache_key(request['token'], str(search_data), param, (after, first, fields))
+        entry = responses.get(key)
+        if entry is None:
+            client = await _client(request)
+            data = await _run(request, listObservables, client, search_data, param, after, first, fields)
+            entry = responses.put(key, data)
+        if _not_modified(request, entry):
+            response = web.Response(status=304)
+        else:
+            response = web.json_response(entry.data, status=201)
+        response.headers['ETag'] = f'"{entry.etag}"'
+        response.last_modified = int(entry.last_modified)
+        response.headers['Cache-Control'] = f'private, max-age={responses.ttl}'
+        return response
+    except web.HTTPException:
+        raise
+    except Exception:
+        return _message("failed!", 500)
+
+
+async def sync_data(request: web.Request) -> web.Response:
+    try:
+        search_data, param = buildFilters(request.query)
+        _, first, fields = buildPagination(request.query)
+        state = decode_sync_token(request.query.get('sync-token'), filters_fingerprint(search_data, param))
+        wait = request.query.get('wait', '0')
+        if not wait.isnumeric():
+            raise ValueError("Error, incorrect wait value")
+        wait = min(int(wait), SYNC_MAX_WAIT)
+    except ValueError as exp:
+        return _message(str(exp), 400)
+
+    try:
+        client = await _client(request)
+        deadline = time.monotonic() + wait
+        while True:
+            entities, has_more = await _run(request, syncPage, client, search_data, param, state, first)
+            # Long-poll: wait for new data until the deadline
+            if entities or time.monotonic() + SYNC_POLL_INTERVAL > deadline:
+                break
+            await asyncio.sleep(SYNC_POLL_INTERVAL)
+        state = advance(state, entities)
+        if fields is not None:
+            entities = project(entities, fields)
+        return web.json_response({'data': entities, 'sync_token': encode_sync_token(state), 'has_more': has_more})
+    except web.HTTPException:
+        raise
+    except Exception:
+        return _message("failed!", 500)
+
+
+async def get_file_data(request: web.Request) -> web.StreamResponse:
+    try:
+        search_data, param = buildFilters(request.query)
+    except ValueError as exp:
+        return _message(str(exp), 400)
+
+    data_format = request.query.get('format', 'json')
+    compression = request.query.get('compression')
+    if data_format not in EXPORT_FORMATS or compression not in (None, 'gzip'):
+        return _message('unsupported format!', 400)
+    try:
+        client = await _client(request)
+        chunks, filename, mimetype = await _run(
+            request, exportObservables, client, search_data, param, data_format, compression
+        )
+    except web.HTTPException:
+        raise
+    except Exception:
+        return _message("failed!", 500)
+    response = web.StreamResponse(
+        headers={
+            'Content-Type': mimetype,
+            'Content-Disposition': f'attachment; filename={filename}',
+        }
+    )
+    await response.prepare(request)
+    while True:
+        chunk = await _run(request, next, chunks, None)
+        if chunk is None:
+            break
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+async def metrics(request: web.Request) -> web.Response:
+    metrics_token = api_config.get('metrics_token')
+    if metrics_token and _token(request) != metrics_token:
+        return _message("unauthorized!", 401)
+    return web.Response(
+        body=REGISTRY.render().encode("utf-8"),
+        headers={'Content-Type': "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def _start(app: web.Application) -> None:
+    await app['validator'].start()
+
+
+async def _stop(app: web.Application) -> None:
+    await app['validator'].close()
+    app['executor'].shutdown(wait=False)
+
+
+def create_app() -> web.Application:
+    """Build the aiohttp application serving the API routes"""
+    app = web.Application(
+        middlewares=[observe_request, auth_required],
+        client_max_size=int(api_config.get('max_body_bytes', 1024 * 1024 * 1024)),
+    )
+    app['validator'] = TokenValidator(
+        config.get('opencti', {}).get('url'),
+        ttl=int(api_config.get('token_ttl', 300)),
+        negative_ttl=int(api_config.get('token_negative_ttl', 30)),
+        capacity=int(api_config.get('client_pool_size', 256)),
+    )
+    authCaches.append(app['validator'])
+    app['executor'] = ThreadPoolExecutor(max_workers=int(api_config.get('async_workers', 32)))
+    app.on_startup.append(_start)
+    app.on_cleanup.append(_stop)
+    app.router.add_post('/push-data', push_data)
+    app.router.add_post('/push-file-data', push_file_data)
+    app.router.add_get('/get-data', get_data)
+    app.router.add_get('/get-file-stix2-data', get_file_data)
+    app.router.add_get('/sync-data', sync_data)
+    app.router.add_get('/metrics', metrics)
+    return app
+
+
+if __name__ == '__main__':
+    # Content-Encoding is decoded by the push routes, within the push limits
+    web.run_app(create_app(), host="0.0.0.0", port=5005, handler_args={'auto_decompress': False})
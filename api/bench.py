@@ -0,0 +1,221 @@
+"""Load benchmark of the push API
+
+Fires concurrent pushes of synthetic records at a running API, in the Flask
+mode (``python run.py`` or behind a WSGI server) or in the asyncio mode
+(``python aio.py``), and reports the throughput and the latency
+percentiles, so both modes can be compared on the same host:
+
+    python bench.py --url http://localhost:5005 --token <token> --concurrency 200
+
+With ``--local flask`` or ``--local aio`` the API is served in-process
+instead, with a stand-in of OpenCTI accepting every token and a temporary
+spool, so the push routes can be measured without an OpenCTI platform. The
+load generator then shares the process with the server: compare local
+results with each other, not with the ones of a separate server.
+
+Requires aiohttp.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+DATASETS = ("domain", "url", "ip", "mixed")
+LABELS = ("Cờ bạc", "Tình dục", "Chất kích thích", "Vũ khí nguy hiểm", "Bạo lực")
+ENDPOINTS = {
+    "push-data": "application/json",
+    "push-file-data": "application/x-ndjson",
+}
+
+
+def _value(dataset: str, index: int) -> str:
+    if dataset == "mixed":
+        dataset = DATASETS[index % 3]
+    if dataset == "url":
+        return f"https://bench-{index % 97}.example.com/{index}"
+    if dataset == "ip":
+        return f"{11 + (index >> 24) % 200}.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+    return f"bench-{index}.example.com"
+
+
+def _payload(size: int, offset: int, dataset: str = "domain", endpoint: str = "push-data") -> bytes:
+    records = [
+        {
+            "value": _value(dataset, offset + index),
+            "description": "benchmark",
+            "label": [LABELS[(offset + index) % len(LABELS)]],
+            "score": 50,
+        }
+        for index in range(size)
+    ]
+    if endpoint == "push-file-data":
+        return "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+    return json.dumps(records).encode("utf-8")
+
+
+async def _stand_in_opencti(request: web.Request) -> web.Response:
+    # Enough of the GraphQL API for the pycti health check and the ``me`` query
+    return web.json_response({"data": {
+        "me": {"id": "bench"},
+        "threatActors": {
+            "edges": [],
+            "pageInfo": {"startCursor": None, "endCursor": None, "hasNextPage": False,
+                         "hasPreviousPage": False, "globalCount": 0},
+        },
+    }})
+
+
+async def _start_local(mode: str, directory: str):
+    """Serve the API in-process, against a stand-in of OpenCTI
+    :return: Url of the API and a coroutine stopping the servers
+    """
+    opencti = web.Application()
+    opencti.router.add_post('/graphql', _stand_in_opencti)
+    opencti_runner = web.AppRunner(opencti, access_log=None)
+    await opencti_runner.setup()
+    opencti_site = web.TCPSite(opencti_runner, "127.0.0.1", 0)
+    await opencti_site.start()
+    opencti_url = f"http://127.0.0.1:{opencti_runner.addresses[0][1]}"
+
+    import spool
+    spool.SPOOL_DIR = directory
+    import run
+    from clients import ClientPool
+    run.config.setdefault('opencti', {})['url'] = opencti_url
+    run.clients = ClientPool(opencti_url)
+
+    if mode == "aio":
+        import aio
+        runner = web.AppRunner(aio.create_app(), access_log=None, auto_decompress=False)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+        async def stop():
+            await runner.cleanup()
+            await opencti_runner.cleanup()
+        return url, stop
+
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, run.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    async def stop():
+        # shutdown() blocks until serve_forever returns, which needs the loop to keep running
+        await asyncio.get_running_loop().run_in_executor(None, server.shutdown)
+        await opencti_runner.cleanup()
+    return f"http://127.0.0.1:{server.server_port}", stop
+
+
+async def _worker(session, url, headers, payloads, latencies, statuses, deadline, counter):
+    while time.monotonic() < deadline and counter[0] > 0:
+        counter[0] -= 1
+        payload = payloads[counter[0] % len(payloads)]
+        started = time.perf_counter()
+        try:
+            async with session.post(url, data=payload, headers=headers) as response:
+                await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            status = 0
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def run(url, token, concurrency, requests, records, duration, dataset="domain", endpoint="push-data"):
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": ENDPOINTS[endpoint]}
+    payloads = [_payload(records, index * records, dataset, endpoint) for index in range(16)]
+    latencies = []
+    statuses = {}
+    counter = [requests]
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(
+            _worker(session, f"{url}/{endpoint}", headers, payloads, latencies, statuses, deadline, counter)
+            for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "records_per_second": round(len(latencies) * records / elapsed, 1),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 2),
+        },
+        "statuses": statuses,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+async def run_local(mode, concurrency, requests, records, duration, dataset, endpoint):
+    with tempfile.TemporaryDirectory(prefix="api-bench-") as directory:
+        url, stop = await _start_local(mode, directory)
+        try:
+            result = await run(url, "bench", concurrency, requests, records, duration, dataset, endpoint)
+        finally:
+            await stop()
+        result["spool_bytes"] = sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://localhost:5005")
+    parser.add_argument("--token")
+    parser.add_argument("--local", choices=("flask", "aio"), help="serve the API in-process instead of using --url")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="push-data")
+    parser.add_argument("--dataset", choices=DATASETS, default="domain")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--records", type=int, default=10, help="records per push")
+    parser.add_argument("--duration", type=float, default=60, help="maximum seconds")
+    args = parser.parse_args()
+    if args.local:
+        result = asyncio.run(run_local(
+            args.local, args.concurrency, args.requests, args.records, args.duration, args.dataset, args.endpoint
+        ))
+    else:
+        if not args.token:
+            parser.error("--token is required unless --local is given")
+        result = asyncio.run(run(
+            args.url.rstrip("/"), args.token, args.concurrency, args.requests, args.records, args.duration,
+            args.dataset, args.endpoint,
+        ))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Short-lived cache of query responses, with validators for conditional requests
+
+Entries are keyed by the scope of the bearer token (a hash of it, as two
+tokens may not see the same data), the normalized filters of the query and
+its pagination cursor. Each entry carries an ETag computed from its content
+and the time it was fetched, so polling clients can revalidate with
+``If-None-Match``/``If-Modified-Since`` and get a ``304 Not Modified``.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, NamedTuple, Optional, Tuple
+
+__all__ = [
+    "CachedResponse",
+    "ResponseCache",
+    "cache_key",
+]
+
+
+class CachedResponse(NamedTuple):
+    data: object
+    etag: str
+    last_modified: float
+    expires: float
+
+
+def cache_key(token: str, search: str, filters: List[dict], cursor: Optional[str] = None) -> Tuple:
+    """Build the cache key of a query
+    :param token: Bearer token of the request
+    :param search: Full-text search of the query
+    :param filters: OpenCTI filters of the query, in any order
+    :param cursor: Pagination cursor of the query
+    :return: A key equal for every equivalent query made with the same token
+    """
+    scope = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    normalized = tuple(
+        sorted(
+            (item["key"], item.get("operator", "eq"), tuple(sorted(item["values"])))
+            for item in filters
+        )
+    )
+    return scope, search.strip(), normalized, cursor
+
+
+class ResponseCache:
+    """Size-bounded TTL cache of query responses"""
+
+    def __init__(self, ttl: int = 10, capacity: int = 1024):
+        """
+        :param ttl: Seconds a response is served without querying OpenCTI again, 0 to disable
+        :param capacity: Maximum number of responses kept
+        """
+        self._ttl = ttl
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """Get a fresh response
+        :param key: Key of the query, from ``cache_key``
+        :return: The response, None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, data: object) -> CachedResponse:
+        """Store the response of a query
+
+        If the content did not change since the previous response of the
+        query, its modification time is kept.
+        :param key: Key of the query, from ``cache_key``
+        :param data: JSON-serializable response
+        :return: The stored response, with its validators
+        """
+        encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+        etag = hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and previous.etag == etag:
+                last_modified = previous.last_modified
+            else:
+                last_modified = now
+            entry = CachedResponse(data, etag, last_modified, now + self._ttl)
+            if self._ttl <= 0 or self._capacity <= 0:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+        return entry
@@ -0,0 +1,165 @@
+"""Pool of OpenCTI clients, one per bearer token
+
+Building an ``OpenCTIApiClient`` runs a health check against OpenCTI, which
+is also how a bearer token is validated. The pool keeps the client of every
+token that passed for ``ttl`` seconds and reuses it for the following
+requests, and remembers the tokens that failed for ``negative_ttl`` seconds
+so repeated calls with a bad token do not reach OpenCTI either.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from pycti import OpenCTIApiClient
+
+__all__ = [
+    "AUTH_ERROR_CODES",
+    "TOKEN_QUERY",
+    "ClientPool",
+    "OpenCTIUnavailable",
+    "check_token",
+    "token_status",
+]
+
+TOKEN_QUERY = "query { me { id } }"
+# Codes and names of the GraphQL errors OpenCTI answers an invalid token with
+AUTH_ERROR_CODES = {"UNAUTHENTICATED", "AuthRequired", "AuthFailure", "FORBIDDEN", "ForbiddenAccess"}
+
+
+class OpenCTIUnavailable(Exception):
+    """OpenCTI could not be reached to validate a token"""
+
+
+def token_status(status: int, body) -> Optional[bool]:
+    """Read the answer of OpenCTI to the token query
+    :param status: HTTP status of the answer
+    :param body: Decoded JSON body of the answer, None if it is not JSON
+    :return: True if the token is accepted, False if it is rejected, None if the answer tells neither
+    """
+    if status == 401:
+        return False
+    if status != 200 or not isinstance(body, dict):
+        return None
+    errors = body.get("errors") or []
+    for error in errors:
+        if not isinstance(error, dict):
+            continue
+        code = (error.get("extensions") or {}).get("code")
+        if code in AUTH_ERROR_CODES or error.get("name") in AUTH_ERROR_CODES:
+            return False
+    if errors or not (body.get("data") or {}).get("me"):
+        return None
+    return True
+
+
+def check_token(url: str, token: str, timeout: float = 10) -> Optional[bool]:
+    """Ask OpenCTI whether it accepts a token
+    :param url: Url of the OpenCTI platform
+    :param token: Bearer token to check
+    :param timeout: Seconds to wait for OpenCTI
+    :return: True if the token is accepted, False if it is rejected, None if OpenCTI can not be reached
+    """
+    try:
+        response = requests.post(
+            f"{url}/graphql",
+            json={"query": TOKEN_QUERY},
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=timeout,
+        )
+    except requests.RequestException:
+        return None
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    return token_status(response.status_code, body)
+
+
+class ClientPool:
+    """Size-bounded cache of validated OpenCTI clients"""
+
+    def __init__(
+        self,
+        url: str,
+        ttl: int = 300,
+        negative_ttl: int = 30,
+        capacity: int = 256,
+        factory: Callable[[str, str], OpenCTIApiClient] = OpenCTIApiClient,
+        check: Callable[[str, str], Optional[bool]] = check_token,
+    ):
+        """
+        :param url: Url of the OpenCTI platform
+        :param ttl: Seconds a validated token is trusted without asking OpenCTI again
+        :param negative_ttl: Seconds a rejected token is refused without asking OpenCTI again
+        :param capacity: Maximum number of tokens remembered
+        :param factory: Builds a client from the url and a token, raises if the token is refused
+        :param check: Tells from the url and a token whether OpenCTI rejects the token, see ``check_token``
+        """
+        self._url = url
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._capacity = capacity
+        self._factory = factory
+        self._check = check
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Optional[OpenCTIApiClient], float]]" = OrderedDict()
+        self._token_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, token: str) -> Tuple[bool, Optional[OpenCTIApiClient]]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= time.monotonic():
+                return False, None
+            self._entries.move_to_end(token)
+            return True, entry[0]
+
+    def _store(self, token: str, client: Optional[OpenCTIApiClient]) -> None:
+        ttl = self._ttl if client is not None else self._negative_ttl
+        with self._lock:
+            self._entries[token] = (client, time.monotonic() + ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def get(self, token: str) -> Optional[OpenCTIApiClient]:
+        """Get the client of a token, validating the token if needed
+        :param token: Bearer token of the request
+        :return: The client, None if OpenCTI refused the token
+        :raises OpenCTIUnavailable: OpenCTI can not be reached, nothing is cached
+        """
+        found, client = self._cached(token)
+        if found:
+            self.hits += 1
+            return client
+        self.misses += 1
+        with self._lock:
+            token_lock = self._token_locks.setdefault(token, threading.Lock())
+        # Concurrent requests with the same new token validate it only once
+        try:
+            with token_lock:
+                found, client = self._cached(token)
+                if not found:
+                    client = self._create(token)
+                    self._store(token, client)
+        finally:
+            with self._lock:
+                self._token_locks.pop(token, None)
+        return client
+
+    def _create(self, token: str) -> Optional[OpenCTIApiClient]:
+        try:
+            return self._factory(self._url, token)
+        except Exception as exp:
+            if self._check(self._url, token) is False:
+                return None
+            raise OpenCTIUnavailable(f"OpenCTI can not validate the token [{exp}]") from exp
+
+    def invalidate(self, token: str) -> None:
+        """Forget a token, so its next request validates it again"""
+        with self._lock:
+            self._entries.pop(token, None)
@@ -0,0 +1,111 @@
+"""Streaming export of observables
+
+Observables are read from OpenCTI one page at a time, following the
+pagination cursors, and serialized as they arrive, so an export of any size
+starts right away and only holds one page in memory. The output can be a
+JSON array, NDJSON or a STIX2 bundle, optionally gzip-compressed on the fly.
+"""
+
+import json
+import uuid
+import zlib
+from typing import Iterable, Iterator, List, Optional
+
+__all__ = [
+    "EXPORT_FORMATS",
+    "EXPORT_MIMETYPES",
+    "CHUNK_SIZE",
+    "iter_pages",
+    "iter_export",
+    "iter_gzip",
+]
+
+EXPORT_FORMATS = ("json", "ndjson", "stix")
+EXPORT_MIMETYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "stix": "application/json",
+}
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_pages(
+    client,
+    search: str,
+    filters: List[dict],
+    page_size: int = 500,
+    after: Optional[str] = None,
+) -> Iterator[List[dict]]:
+    """Iterate over the pages of a query of observables
+    :param client: OpenCTI client of the request
+    :param search: Full-text search of the query
+    :param filters: OpenCTI filters of the query
+    :param page_size: Number of observables asked per page
+    :param after: Cursor to start after, None to start from the beginning
+    :return: The observables of each page
+    """
+    while True:
+        page = client.stix_cyber_observable.list(
+            search=search,
+            filters=filters,
+            first=page_size,
+            after=after,
+            withPagination=True,
+        )
+        yield page["entities"]
+        pagination = page["pagination"]
+        if not pagination["hasNextPage"] or not page["entities"]:
+            return
+        after = pagination["endCursor"]
+
+
+def _iter_documents(client, pages: Iterable[List[dict]], data_format: str) -> Iterator[str]:
+    separator = ""
+    if data_format == "json":
+        yield "["
+    elif data_format == "stix":
+        yield f'{{"type": "bundle", "id": "bundle--{uuid.uuid4()}", "objects": ['
+    for page in pages:
+        for entity in page:
+            if data_format == "ndjson":
+                yield json.dumps(entity) + "\n"
+                continue
+            if data_format == "stix":
+                entity = client.stix2.generate_export(entity)
+            yield separator + json.dumps(entity)
+            separator = ", "
+    if data_format == "json":
+        yield "]"
+    elif data_format == "stix":
+        yield "]}"
+
+
+def iter_export(client, pages: Iterable[List[dict]], data_format: str = "json") -> Iterator[bytes]:
+    """Serialize pages of observables into chunks of an export
+    :param client: OpenCTI client, used to convert observables to STIX2
+    :param pages: Pages of observables, usually from ``iter_pages``
+    :param data_format: One of ``EXPORT_FORMATS``
+    :return: Chunks of about ``CHUNK_SIZE`` bytes of the export
+    """
+    buffer = []
+    buffered = 0
+    for document in _iter_documents(client, pages, data_format):
+        encoded = document.encode("utf-8")
+        buffer.append(encoded)
+        buffered += len(encoded)
+        if buffered >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Gzip-compress a stream of chunks on the fly"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,464 @@
+"""Streaming ingestion of uploaded feed files into the spool
+
+Uploads are never loaded whole: records are decoded one by one from the
+request stream, every record is validated on its own and the valid ones are
+appended to the spool in small batches. Memory use depends on the batch
+size, not on the size of the upload.
+
+Besides JSON arrays, feeds can be sent as NDJSON, CSV (with a column
+mapping) or plain text lists of values, optionally compressed with gzip or
+zstd. The format is taken from the file extension or the content type.
+"""
+
+import codecs
+import csv
+import gzip
+import io
+import json
+from typing import IO, Iterator, List, NamedTuple, Optional, Tuple
+
+from spool import append_records
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = [
+    "FORMATS",
+    "COMPRESSIONS",
+    "ALLOWED_LABELS",
+    "MAX_VALUE_LENGTH",
+    "MAX_DESCRIPTION_LENGTH",
+    "ColumnMapping",
+    "RecordDefaults",
+    "IngestError",
+    "IngestResult",
+    "NotAnArrayError",
+    "PayloadTooLarge",
+    "LimitedReader",
+    "detect_format",
+    "decompress",
+    "iter_json_array",
+    "iter_ndjson",
+    "iter_csv",
+    "iter_text",
+    "validate_record",
+    "ingest",
+]
+
+FORMATS = ("json", "ndjson", "csv", "text")
+COMPRESSIONS = ("gzip", "zstd")
+
+_EXTENSIONS = {
+    ".json": "json",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".csv": "csv",
+    ".txt": "text",
+    ".list": "text",
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+}
+
+_MIMETYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+    "text/plain": "text",
+    "application/gzip": "gzip",
+    "application/x-gzip": "gzip",
+    "application/zstd": "zstd",
+}
+
+# Same rules as the validation of the connector, so that no accepted record
+# is rejected later on. Copied from templateConnector/classifier.py, which the
+# API can not import; tests/test_ingest.py fails if the copies drift
+ALLOWED_LABELS = frozenset(
+    ["Cờ bạc", "Tình dục", "Chất kích thích", "Vũ khí nguy hiểm", "Bạo lực"]
+)
+MAX_VALUE_LENGTH = 512
+MAX_DESCRIPTION_LENGTH = 1024
+
+READ_SIZE = 64 * 1024
+MAX_ITEM_BYTES = 1024 * 1024
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class NotAnArrayError(ValueError):
+    """The upload is not a JSON array"""
+
+
+class PayloadTooLarge(ValueError):
+    """A push body is larger than allowed"""
+
+
+class LimitedReader(io.RawIOBase):
+    """Binary stream failing once more than ``max_bytes`` were read"""
+
+    def __init__(self, stream: IO[bytes], max_bytes: int):
+        self._stream = stream
+        self._remaining = max_bytes
+        self._max_bytes = max_bytes
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        # Read one byte more than allowed to tell a full body from a truncated one
+        data = self._stream.read(min(len(buffer), self._remaining + 1))
+        if len(data) > self._remaining:
+            raise PayloadTooLarge(f"payload exceeds {self._max_bytes} bytes")
+        self._remaining -= len(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class ColumnMapping(NamedTuple):
+    """CSV columns holding the record fields"""
+
+    value: str = "value"
+    description: str = "description"
+    label: str = "label"
+    score: str = "score"
+    label_separator: str = ";"
+
+
+class RecordDefaults(NamedTuple):
+    """Fields set on records that do not carry them, e.g. plain text lists"""
+
+    description: Optional[str] = None
+    label: Optional[List[str]] = None
+    score: Optional[int] = None
+
+
+class _InvalidItem(NamedTuple):
+    message: str
+
+
+class IngestError(NamedTuple):
+    """An item of the upload that was not spooled"""
+
+    index: int
+    message: str
+
+
+class IngestResult(NamedTuple):
+    """Outcome of an ingestion"""
+
+    accepted: int
+    rejected: int
+    errors: List[IngestError]
+    too_large: Optional[str] = None
+
+
+class _Reader:
+    """Text buffer refilled from a byte stream"""
+
+    def __init__(self, stream: IO[bytes]):
+        self._stream = stream
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buffer = ""
+        self.offset = 0
+        self.position = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Read more text, dropping what has already been consumed
+        :return: False once the stream is exhausted
+        """
+        if self.eof:
+            return False
+        chunk = self._stream.read(READ_SIZE)
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        self.eof = not chunk
+        self.offset += self.position
+        self.buffer = self.buffer[self.position:] + self._decoder.decode(chunk, final=self.eof)
+        self.position = 0
+        return not self.eof
+
+    def skip(self, characters: str) -> Optional[str]:
+        """Skip characters and return the next one, None at the end of the stream"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in characters:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return None
+
+
+def iter_json_array(stream: IO[bytes]) -> Iterator[object]:
+    """Iterate over the items of a top-level JSON array without loading it
+    :param stream: Binary stream holding the array
+    :return: The decoded items
+    :raises NotAnArrayError: If the stream does not start with an array
+    :raises ValueError: If an item is not valid JSON, items before it are yielded
+    """
+    reader = _Reader(stream)
+    if reader.skip(_WHITESPACE) != "[":
+        raise NotAnArrayError("Upload is not a JSON array")
+    reader.position += 1
+    if reader.skip(_WHITESPACE) == "]":
+        return
+    while True:
+        if reader.skip(_WHITESPACE) is None:
+            raise ValueError("Unterminated JSON array")
+        while True:
+            try:
+                item, end = _decoder.raw_decode(reader.buffer, reader.position)
+            except ValueError:
+                item, end = None, None
+            # An item ending with the buffer may be cut, e.g. a number
+            if end is not None and (end < len(reader.buffer) or reader.eof):
+                break
+            if len(reader.buffer) - reader.position > MAX_ITEM_BYTES or not reader.fill():
+                if end is not None:
+                    break
+                raise ValueError(f"Invalid JSON item at character {reader.offset + reader.position}")
+        reader.position = end
+        yield item
+        separator = reader.skip(_WHITESPACE)
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' at character {reader.offset + reader.position}")
+        reader.position += 1
+
+
+def detect_format(filename: Optional[str], mimetype: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Find the format and compression of an upload
+    :param filename: Name of the uploaded file, e.g. ``feed.csv.gz``
+    :param mimetype: Content type of the upload, e.g. of the file part of a multipart form
+    :return: The format and the compression, None if not compressed
+    """
+    data_format = None
+    compression = None
+    name = (filename or "").lower()
+    while True:
+        dot = name.rfind(".")
+        kind = _EXTENSIONS.get(name[dot:]) if dot >= 0 else None
+        if kind in COMPRESSIONS and compression is None:
+            compression = kind
+            name = name[:dot]
+            continue
+        if kind in FORMATS:
+            data_format = kind
+        break
+    kind = _MIMETYPES.get((mimetype or "").split(";")[0].strip().lower())
+    if kind in COMPRESSIONS:
+        compression = compression or kind
+    elif kind in FORMATS:
+        data_format = data_format or kind
+    return data_format or "json", compression
+
+
+def decompress(stream: IO[bytes], compression: Optional[str]) -> IO[bytes]:
+    """Wrap a stream to decompress it on the fly
+    :param stream: Binary stream
+    :param compression: gzip, zstd or None
+    :return: Binary stream of the decompressed data
+    """
+    if compression is None:
+        return stream
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd uploads require the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def _text_lines(stream: IO[bytes]) -> IO[str]:
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+
+
+def iter_ndjson(stream: IO[bytes]) -> Iterator[object]:
+    """Iterate over the records of a newline delimited JSON stream
+    :param stream: Binary stream
+    :return: The decoded records, undecodable lines are reported as invalid items
+    """
+    for line in _text_lines(stream):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exp:
+            yield _InvalidItem(f"Invalid JSON line: {exp}")
+
+
+def iter_csv(stream: IO[bytes], mapping: ColumnMapping = ColumnMapping()) -> Iterator[object]:
+    """Iterate over the records of a CSV stream with a header row
+    :param stream: Binary stream
+    :param mapping: Columns holding the record fields
+    :return: The mapped records
+    """
+    reader = csv.DictReader(_text_lines(stream))
+    if reader.fieldnames is None:
+        return
+    if mapping.value not in reader.fieldnames:
+        raise ValueError(f"Missing CSV column: {mapping.value}")
+    for row in reader:
+        record = {"value": (row.get(mapping.value) or "").strip()}
+        description = row.get(mapping.description)
+        if description:
+            record["description"] = description
+        labels = row.get(mapping.label)
+        if labels:
+            record["label"] = [
+                label.strip()
+                for label in labels.split(mapping.label_separator)
+                if label.strip()
+            ]
+        score = row.get(mapping.score)
+        if score:
+            try:
+                record["score"] = int(score)
+            except ValueError:
+                yield _InvalidItem(f"Invalid score: {score}")
+                continue
+        yield record
+
+
+def iter_text(stream: IO[bytes]) -> Iterator[object]:
+    """Iterate over a plain text list of values, one per line
+    :param stream: Binary stream, lines starting with # are comments
+    :return: One record per value
+    """
+    for line in _text_lines(stream):
+        value = line.strip()
+        if value and not value.startswith("#"):
+            yield {"value": value}
+
+
+def _iter_items(stream: IO[bytes], data_format: str, mapping: ColumnMapping) -> Iterator[object]:
+    if data_format == "json":
+        return iter_json_array(stream)
+    if data_format == "ndjson":
+        return iter_ndjson(stream)
+    if data_format == "csv":
+        return iter_csv(stream, mapping)
+    if data_format == "text":
+        return iter_text(stream)
+    raise ValueError(f"Unsupported format: {data_format}")
+
+
+def _apply_defaults(record: dict, defaults: RecordDefaults) -> None:
+    for field, default in defaults._asdict().items():
+        if default is not None and field not in record:
+            record[field] = default
+
+
+def validate_record(record: object) -> Optional[str]:
+    """Check a pushed record with the rules of the connector
+    :param record: Decoded record, with its defaults applied
+    :return: Why the record is invalid, None if it is valid
+    """
+    if not isinstance(record, dict):
+        return "record is not an object"
+    if not isinstance(record.get("value"), str) or not record["value"]:
+        return "missing value"
+    if len(record["value"]) > MAX_VALUE_LENGTH:
+        return f"value is longer than {MAX_VALUE_LENGTH} characters"
+    description = record.get("description", "")
+    if not isinstance(description, str):
+        return "description is not a string"
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        return f"description is longer than {MAX_DESCRIPTION_LENGTH} characters"
+    if "label" not in record:
+        return "missing label"
+    if not isinstance(record["label"], list):
+        return "label is not a list"
+    unknown = [label for label in record["label"] if not isinstance(label, str) or label not in ALLOWED_LABELS]
+    if unknown:
+        return f"unknown label: {unknown[0]}"
+    return None
+
+
+def ingest(
+    token: str,
+    stream: IO[bytes],
+    data_format: str = "json",
+    compression: Optional[str] = None,
+    mapping: ColumnMapping = ColumnMapping(),
+    defaults: RecordDefaults = RecordDefaults(),
+    max_records: int = 0,
+    max_bytes: int = 0,
+) -> IngestResult:
+    """Validate the records of an upload and spool them
+
+    Without limits, records are spooled by batches while the upload is read.
+    With ``max_records`` or ``max_bytes``, the records are only spooled once
+    the whole upload was read within the limits: reading stops at the first
+    item past ``max_records``, or once more than ``max_bytes`` were decoded,
+    and then nothing is spooled and the result tells which limit was hit.
+    :param token: Bearer token of the pushing user
+    :param stream: Binary stream holding the upload
+    :param data_format: One of FORMATS
+    :param compression: One of COMPRESSIONS, None if not compressed
+    :param mapping: Columns holding the record fields, for CSV uploads
+    :param defaults: Fields set on records that do not carry them
+    :param max_records: Maximum number of items of the upload, 0 for no limit
+    :param max_bytes: Maximum decoded size of the upload, 0 for no limit
+    :return: Counts of accepted and rejected records, with the first errors
+    :raises NotAnArrayError: If a JSON upload does not start with an array
+    """
+    accepted = 0
+    rejected = 0
+    errors = []
+    batch = []
+
+    def reject(index: int, message: str) -> None:
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append(IngestError(index, message))
+
+    too_large = None
+    limited = bool(max_records or max_bytes)
+    try:
+        decoded = decompress(stream, compression)
+        if max_bytes:
+            decoded = io.BufferedReader(LimitedReader(decoded, max_bytes))
+        items = _iter_items(decoded, data_format, mapping)
+        for index, record in enumerate(items):
+            if max_records and index >= max_records:
+                too_large = f"batch exceeds {max_records} records"
+                break
+            if isinstance(record, _InvalidItem):
+                reject(index, record.message)
+                continue
+            if isinstance(record, dict):
+                _apply_defaults(record, defaults)
+            reason = validate_record(record)
+            if reason is not None:
+                reject(index, reason)
+                continue
+            batch.append(record)
+            if len(batch) >= BATCH_SIZE and not limited:
+                append_records(token, batch)
+                accepted += len(batch)
+                batch = []
+    except NotAnArrayError:
+        raise
+    except PayloadTooLarge as exp:
+        too_large = str(exp)
+    except (ValueError, OSError, EOFError) as exp:
+        # Records before the error are kept, the rest cannot be read
+        reject(accepted + len(batch) + rejected, str(exp))
+    if too_large is not None:
+        return IngestResult(0, rejected, errors, too_large)
+    if batch:
+        append_records(token, batch)
+        accepted += len(batch)
+    return IngestResult(accepted, rejected, errors, too_large)
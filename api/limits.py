@@ -0,0 +1,167 @@
+"""Request body decoding, push size limits and spool backpressure
+
+Push bodies may be sent with ``Content-Encoding: gzip`` or ``zstd``; they are
+decoded on the fly and the decoded size is bounded, so a small compressed
+body cannot expand without limit. Each push is also bounded in records and
+bytes, with defaults that can be overridden per token.
+
+When the connector falls behind, pushes are refused with ``429`` before
+anything is spooled. The depth of a spool is the size of its active file
+and of its claimed segments; the connector publishes how fast it drains the
+spool directory in ``.drain`` there, and ``Retry-After`` is the time it
+needs at that rate to bring the spool back to half its limit.
+"""
+
+import io
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import IO, Dict, NamedTuple, Optional, Tuple
+
+from ingest import LimitedReader, PayloadTooLarge, decompress
+
+__all__ = [
+    "CONTENT_ENCODINGS",
+    "DRAIN_FILE",
+    "PayloadTooLarge",
+    "PushLimits",
+    "LimitedReader",
+    "decode_body",
+    "Backpressure",
+]
+
+CONTENT_ENCODINGS = {
+    "identity": None,
+    "gzip": "gzip",
+    "x-gzip": "gzip",
+    "zstd": "zstd",
+}
+DRAIN_FILE = ".drain"
+MAX_RETRY_AFTER = 300
+
+_SEGMENT_RE = re.compile(r"^([A-Za-z0-9_-]+)(?:\.\d+)+\.claimed$")
+
+
+class PushLimits(NamedTuple):
+    max_records: int
+    max_bytes: int
+
+    @classmethod
+    def from_config(cls, api_config: dict, token: str) -> "PushLimits":
+        """Limits of a token: the ``api`` defaults, overridden by ``api.token_limits.<token>``"""
+        overrides = (api_config.get('token_limits') or {}).get(token) or {}
+        return cls(
+            max_records=int(overrides.get('max_batch_records', api_config.get('max_batch_records', 10000))),
+            max_bytes=int(overrides.get('max_batch_bytes', api_config.get('max_batch_bytes', 16 * 1024 * 1024))),
+        )
+
+
+def decode_body(stream: IO[bytes], content_encoding: Optional[str], max_bytes: int) -> IO[bytes]:
+    """Wrap a request body to decode and bound it on the fly
+    :param stream: Raw request body
+    :param content_encoding: Value of the ``Content-Encoding`` header
+    :param max_bytes: Maximum decoded size
+    :return: Binary stream of the decoded body
+    :raises ValueError: If the encoding is not supported
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+    decoded = decompress(stream, CONTENT_ENCODINGS[encoding])
+    return io.BufferedReader(LimitedReader(decoded, max_bytes))
+
+
+class Backpressure:
+    """Admission of pushes from the depth of the spools and the drain rate"""
+
+    def __init__(
+        self,
+        directory: str,
+        max_token_bytes: int = 256 * 1024 * 1024,
+        max_total_bytes: int = 1024 * 1024 * 1024,
+        default_retry_after: int = 30,
+        refresh: float = 1.0,
+    ):
+        """
+        :param directory: Spool directory
+        :param max_token_bytes: Spool depth of a token above which its pushes are refused, 0 for no limit
+        :param max_total_bytes: Depth of all spools above which every push is refused, 0 for no limit
+        :param default_retry_after: Retry-After while the drain rate is unknown
+        :param refresh: Seconds the measured depths are reused
+        """
+        self._directory = directory
+        self._max_token_bytes = max_token_bytes
+        self._max_total_bytes = max_total_bytes
+        self._default_retry_after = default_retry_after
+        self._refresh = refresh
+        self._lock = threading.Lock()
+        self._measured = 0.0
+        self._depths: Dict[str, int] = {}
+        self._total = 0
+        self._drain_rate: Optional[float] = None
+
+    def _measure(self) -> Tuple[Dict[str, int], int, Optional[float]]:
+        with self._lock:
+            if time.monotonic() - self._measured < self._refresh:
+                return self._depths, self._total, self._drain_rate
+            depths = {}
+            drain_rate = None
+            try:
+                entries = list(os.scandir(self._directory))
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                if entry.name == DRAIN_FILE:
+                    drain_rate = self._read_drain_rate(entry.path)
+                if entry.name.startswith("."):
+                    continue
+                match = _SEGMENT_RE.match(entry.name)
+                token = match.group(1) if match else entry.name
+                try:
+                    size = entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+                depths[token] = depths.get(token, 0) + size
+            self._depths = depths
+            self._total = sum(depths.values())
+            self._drain_rate = drain_rate
+            self._measured = time.monotonic()
+            return self._depths, self._total, self._drain_rate
+
+    @staticmethod
+    def _read_drain_rate(path: str) -> Optional[float]:
+        try:
+            with open(path, "r", encoding="utf-8") as drain_file:
+                drain = json.load(drain_file)
+            rate = float(drain["bytes_per_second"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return rate if rate > 0 else None
+
+    def depths(self) -> Tuple[Dict[str, int], Optional[float]]:
+        """Current depth of the spool of every token and drain rate of the connector"""
+        depths, _, drain_rate = self._measure()
+        return depths, drain_rate
+
+    def _retry_after(self, excess: int, drain_rate: Optional[float]) -> int:
+        if drain_rate is None:
+            return self._default_retry_after
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(excess / drain_rate)))
+
+    def retry_after(self, token: str) -> Optional[int]:
+        """Check whether a push of a token can be spooled now
+        :param token: Bearer token of the pushing user
+        :return: Seconds to wait before retrying, None if the push is admitted
+        """
+        depths, total, drain_rate = self._measure()
+        if self._max_total_bytes and total >= self._max_total_bytes:
+            return self._retry_after(total - self._max_total_bytes // 2, drain_rate)
+        depth = depths.get(token, 0)
+        if self._max_token_bytes and depth >= self._max_token_bytes:
+            # The connector shares its drain rate between the tenants with a backlog
+            share = drain_rate / max(1, len(depths)) if drain_rate is not None else None
+            return self._retry_after(depth - self._max_token_bytes // 2, share)
+        return None
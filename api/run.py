@@ -2,18 +2,31 @@ import os
 import time
 import json
 import yaml
-import dateutil
 import re
+import itertools
+import hashlib
 
-from flask import Flask, request, send_file
+from flask import Flask, g, request, Response
 from flask_restful import Resource, Api
-from pycti import OpenCTIApiClient
 
-from werkzeug.utils import secure_filename
+from ingest import (
+    COMPRESSIONS,
+    FORMATS,
+    ColumnMapping,
+    NotAnArrayError,
+    RecordDefaults,
+    detect_format,
+    ingest,
+)
+from spool import SPOOL_DIR, append_records
+from limits import Backpressure, PayloadTooLarge, PushLimits, decode_body
+from sync import advance, decode_sync_token, encode_sync_token, filters_fingerprint, unseen
+from cache import ResponseCache, cache_key
+from clients import ClientPool, OpenCTIUnavailable
+from export import EXPORT_FORMATS, EXPORT_MIMETYPES, iter_export, iter_gzip, iter_pages
+from metrics import REGISTRY, Counter, Gauge, Histogram
 from functools import wraps
 
-from pycti import OpenCTIApiClient
-
   
 app = Flask(__name__)
 
@@ -25,6 +38,93 @@ config = (
     if os.path.isfile(config_file_path)
     else {}
 )
+api_config = config.get('api') or {}
+
+clients = ClientPool(
+    config.get('opencti', {}).get('url'),
+    ttl=int(api_config.get('token_ttl', 300)),
+    negative_ttl=int(api_config.get('token_negative_ttl', 30)),
+    capacity=int(api_config.get('client_pool_size', 256)),
+)
+MAX_UPLOAD_BYTES = int(api_config.get('max_upload_bytes', 1024 * 1024 * 1024))
+
+backpressure = Backpressure(
+    SPOOL_DIR,
+    max_token_bytes=int(api_config.get('max_spool_bytes', 256 * 1024 * 1024)),
+    max_total_bytes=int(api_config.get('max_spool_total_bytes', 1024 * 1024 * 1024)),
+    default_retry_after=int(api_config.get('retry_after', 30)),
+)
+
+authCaches = [clients]
+
+REQUESTS = Counter("api_requests_total", "Requests served, by route, method and status", ["route", "method", "status"])
+REQUEST_SECONDS = Histogram("api_request_seconds", "Time to answer the requests, up to the response headers, by route", ["route"])
+RECORDS_SPOOLED = Counter("api_records_spooled_total", "Records appended to the spool")
+RECORDS_REJECTED = Counter("api_records_rejected_total", "Records of uploads rejected by validation")
+PUSHES_REFUSED = Counter("api_pushes_refused_total", "Pushes refused before spooling, by reason", ["reason"])
+Counter(
+    "api_auth_cache_lookups_total",
+    "Token validations answered from the cache (hit) or by OpenCTI (miss)",
+    ["result"],
+    collect=lambda: {
+        ("hit",): sum(cache.hits for cache in authCaches),
+        ("miss",): sum(cache.misses for cache in authCaches),
+    },
+)
+Counter(
+    "api_response_cache_lookups_total",
+    "Queries answered from the response cache (hit) or by OpenCTI (miss)",
+    ["result"],
+    collect=lambda: {("hit",): responses.hits, ("miss",): responses.misses},
+)
+
+def tenant(token):
+    """Fingerprint of a token, safe to show in metrics"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+
+Gauge(
+    "api_spool_depth_bytes",
+    "Bytes waiting in the spool of each tenant",
+    ["tenant"],
+    collect=lambda: {(tenant(token),): depth for token, depth in backpressure.depths()[0].items()},
+)
+Gauge(
+    "api_spool_drain_rate_bytes",
+    "Bytes of spool processed per second by the connector",
+    collect=lambda: {(): backpressure.depths()[1] or 0},
+)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = int(api_config.get('max_page_size', 500))
+SYNC_MAX_WAIT = int(api_config.get('sync_max_wait', 30))
+SYNC_POLL_INTERVAL = float(api_config.get('sync_poll_interval', 2))
+
+responses = ResponseCache(
+    ttl=int(api_config.get('cache_ttl', 10)),
+    capacity=int(api_config.get('cache_size', 1024)),
+)
+
+def routeName():
+    """Route of the current request, as a bounded metric label"""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@app.before_request
+def startTimer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observeRequest(response):
+    route = routeName()
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, route=route)
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def exportMetrics():
+    metrics_token = api_config.get('metrics_token')
+    if metrics_token and getToken() != metrics_token:
+        return {'message': "unauthorized!"}, 401
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 def getToken():
     try:
@@ -43,13 +143,24 @@ def auth_required(f):
         if not token:
             return {'message': "unauthorized!"}, 401  
         try:
-            opencti_api_client = OpenCTIApiClient(config['opencti']['url'], token)
-        except Exception as exp:
-            raise (exp)
+            g.opencti_api_client = clients.get(token)
+        except OpenCTIUnavailable:
+            return {'message': "OpenCTI is unavailable, retry later!"}, 503
+        if g.opencti_api_client is None:
             return {'message': "unauthorized!"}, 401  
         return f(*args, **kwargs)
     return decorated_function
 
+def admission_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        retry_after = backpressure.retry_after(getToken())
+        if retry_after is not None:
+            PUSHES_REFUSED.inc(reason="backpressure")
+            return {'message': "spool is full, retry later!"}, 429, {'Retry-After': str(retry_after)}
+        return f(*args, **kwargs)
+    return decorated_function
+
 DATETIME_ISO8601 = re.compile(
     r'^([0-9]{4})' r'-' r'([0-9]{1,2})' r'-' r'([0-9]{1,2})' # date
     r'([T\s][0-9]{1,2}:[0-9]{1,2}:?[0-9]{1,2}(\.[0-9]{1,6})?)?' # time
@@ -63,202 +174,315 @@ def datetime_iso(string):
     string = string.strip()
     return bool(re.fullmatch(DATETIME_ISO8601, string))
 
+def buildFilters(args_param):
+    """Build the OpenCTI search and filters of an observable query
+    :param args_param: Query string of the request
+    :return: The search string and the filters, raises ValueError on an invalid parameter
+    """
+    param = []
+
+    # start time to time now
+    if args_param.get('start-time') is not None:
+        if not datetime_iso(args_param.get('start-time')):
+            raise ValueError("Error, incorrect date values")
+        param.append({"key": "created_at", "values": [f"{args_param.get('start-time')}"], "operator": "gt"})
+
+    # score >
+    if args_param.get('score') is not None:
+        if args_param.get('score') == '':
+            raise ValueError("Error, incorrect date values")
+        if args_param.get('score').isnumeric():
+            param.append({"key": "x_opencti_score", "values": [f"{args_param.get('score')}"], "operator": "gt"})
+
+    # score <= 
+    if args_param.get('score-lte') is not None:
+        if args_param.get('score-lte') == '':
+            raise ValueError("Error, incorrect date values")
+        if args_param.get('score-lte').isnumeric():
+            param.append({"key": "x_opencti_score", "values": [f"{args_param.get('score-lte')}"], "operator": "lte"})
+
+    # search
+    search_data = args_param.get('search') or ''
+    return search_data, param
+
+def buildPagination(args_param):
+    """Read the pagination and projection parameters of an observable query
+    :param args_param: Query string of the request
+    :return: The cursor to start after, the page size and the fields to keep (None for all)
+    """
+    after = args_param.get('after') or None
+    first = args_param.get('first', str(DEFAULT_PAGE_SIZE))
+    if not first.isnumeric() or not 0 < int(first) <= MAX_PAGE_SIZE:
+        raise ValueError(f"Error, first must be between 1 and {MAX_PAGE_SIZE}")
+    fields = args_param.get('fields')
+    if fields is not None:
+        fields = tuple(sorted({'id', *(field.strip() for field in fields.split(',') if field.strip())}))
+    return after, int(first), fields
+
+def cachedResponse(entry, status=200):
+    """Answer with a cached response, or 304 if the client already has it"""
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(entry.etag)
+    else:
+        not_modified = (
+            request.if_modified_since is not None
+            and int(entry.last_modified) <= request.if_modified_since.timestamp()
+        )
+    response = app.response_class(status=304) if not_modified else api.make_response(entry.data, status)
+    response.set_etag(entry.etag)
+    response.last_modified = int(entry.last_modified)
+    response.cache_control.private = True
+    response.cache_control.max_age = responses.ttl
+    return response
+
+def pushRecords(token, stream, content_encoding, content_length=None):
+    """Spool a JSON array of records sent as a request body, within the push limits of the token"""
+    limits = PushLimits.from_config(api_config, token)
+    if not content_encoding and content_length is not None and content_length > limits.max_bytes:
+        PUSHES_REFUSED.inc(reason="too-large")
+        return {'message': f"payload exceeds {limits.max_bytes} bytes!"}, 413
+    try:
+        stream = decode_body(stream, content_encoding, limits.max_bytes)
+    except ValueError:
+        return {'message': "unsupported content encoding!"}, 415
+    try:
+        body = stream.read()
+    except PayloadTooLarge as exp:
+        PUSHES_REFUSED.inc(reason="too-large")
+        return {'message': f"{exp}!"}, 413
+    except (ValueError, OSError, EOFError):
+        return {'message': 'data error!'}, 400
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return {'message': 'data error!'}, 400
+    if type(data) != list:
+        return {'message': 'data error!'}, 400
+    if len(data) > limits.max_records:
+        PUSHES_REFUSED.inc(reason="too-many-records")
+        return {'message': f"batch exceeds {limits.max_records} records!"}, 413
+    append_records(token, data)
+    RECORDS_SPOOLED.inc(len(data))
+    return {'message': "suceess!"}, 201
+
+def uploadStream(stream, content_encoding=None):
+    """Decode an upload on the fly, bounded to the maximum upload size"""
+    return decode_body(stream, content_encoding, MAX_UPLOAD_BYTES)
+
+def ingestUpload(token, stream, args_param, mimetype, filename=None, limits=None):
+    """Spool an upload in any of the supported feed formats
+    :param limits: Limits of a push, checked before anything is spooled, None for file uploads
+    """
+    data_format, compression = detect_format(filename, mimetype)
+    data_format = args_param.get('format') or data_format
+    compression = args_param.get('compression') or compression
+    if data_format not in FORMATS or (compression is not None and compression not in COMPRESSIONS):
+        return {'message': 'unsupported format!'}, 400
+    mapping = ColumnMapping(
+        value=args_param.get('value-column', 'value'),
+        description=args_param.get('description-column', 'description'),
+        label=args_param.get('label-column', 'label'),
+        score=args_param.get('score-column', 'score'),
+        label_separator=args_param.get('label-separator', ';'),
+    )
+    score = args_param.get('score')
+    if score is not None and not score.isnumeric():
+        return {'message': "Error, incorrect score value"}, 400
+    defaults = RecordDefaults(
+        description=args_param.get('description'),
+        label=args_param.getlist('label') or None,
+        score=int(score) if score is not None else None,
+    )
+    try:
+        result = ingest(
+            token, stream, data_format, compression, mapping, defaults,
+            max_records=limits.max_records if limits is not None else 0,
+            max_bytes=limits.max_bytes if limits is not None else 0,
+        )
+    except NotAnArrayError:
+        return {'message': 'data is not list format!'}, 400
+    RECORDS_SPOOLED.inc(result.accepted)
+    RECORDS_REJECTED.inc(result.rejected)
+    if result.too_large is not None:
+        PUSHES_REFUSED.inc(reason="too-large")
+        return {
+            'message': f"{result.too_large}!",
+            'accepted': result.accepted,
+            'rejected': result.rejected,
+            'errors': [error._asdict() for error in result.errors],
+        }, 413
+    if result.accepted == 0 and result.rejected > 0:
+        status = 400
+    else:
+        status = 201
+    return {
+        'message': "suceess!" if status == 201 else "failed!",
+        'accepted': result.accepted,
+        'rejected': result.rejected,
+        'errors': [error._asdict() for error in result.errors],
+    }, status
+
 class PushData(Resource):
 
     @auth_required
+    @admission_required
     def post(self):
         try:
-            data = request.get_json()     
-            if type(data) != list:
-                return {'message': 'data error!'}, 400
-            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", getToken())
-            if not os.path.exists(path):
-                f = open(path, "w+")
-                f.close()
-            dataFilePointer = open(path)
-            dataFile = dataFilePointer.read()
-            dataFilePointer.close()
-            try:
-                listData = json.loads(dataFile)
-            except Exception as exp:
-                print ("Can not read data file")
-                listData = []
-            listData.extend(data)
-            dataFilePointer = open(path, "w")
-            dataFilePointer.write(json.dumps(listData))
-            dataFilePointer.close()
-            return {'message': "suceess!"}, 201
-        except Exception as exp:
+            content_encoding = request.headers.get('Content-Encoding')
+            if request.mimetype != "application/json":
+                try:
+                    stream = uploadStream(request.stream, content_encoding)
+                except ValueError:
+                    return {'message': "unsupported content encoding!"}, 415
+                limits = PushLimits.from_config(api_config, getToken())
+                return ingestUpload(getToken(), stream, request.values, request.mimetype, limits=limits)
+            return pushRecords(getToken(), request.stream, content_encoding, request.content_length)
+        except Exception:
             return {'message': "failed!"}, 500 
 
 
 class PushFileData(Resource):
 
     @auth_required
+    @admission_required
     def post(self):
         try:
-            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", getToken())
-            if "file-data" not in request.files:
-                return {'message': "missing file-data!"}, 400 
-            fileUpload = request.files['file-data']
-            uniqueName = str(time.time()) + secure_filename(fileUpload.filename)
-            fileUpload.save(os.path.join(os.path.dirname(os.path.abspath(__file__)), uniqueName))
-
-            dataFilePointer = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", uniqueName))
-            data = dataFilePointer.read()
-            dataFilePointer.close()
-            try:
-                reqListData = json.loads(data)
-            except Exception as exp:
-                print ("Can not read data")
-                return {'message': "failed!"}, 400 
-            if type(reqListData) != list:
-                return {'message': 'data is not list format!'}, 400
-
-            if not os.path.exists(path):
-                f = open(path, "w+")
-                f.close()
-            dataFilePointer = open(path)
-            dataFile = dataFilePointer.read()
-            dataFilePointer.close()
-            try:
-                listData = json.loads(dataFile)
-            except Exception as exp:
-                print ("Can not read data file")
-                listData = []
-
-            listData.extend(reqListData)
-
-            dataFilePointer = open(path, "w")
-            dataFilePointer.write(json.dumps(listData))
-            dataFilePointer.close()
-
-            return {'message': "suceess!"}, 201 
-        except Exception as exp:
+            if "file-data" in request.files:
+                fileUpload = request.files['file-data']
+                return ingestUpload(getToken(), uploadStream(fileUpload.stream), request.values, fileUpload.mimetype, fileUpload.filename)
+            if request.mimetype not in ("multipart/form-data", "application/x-www-form-urlencoded"):
+                try:
+                    stream = uploadStream(request.stream, request.headers.get('Content-Encoding'))
+                except ValueError:
+                    return {'message': "unsupported content encoding!"}, 415
+                return ingestUpload(getToken(), stream, request.values, request.mimetype)
+            return {'message': "missing file-data!"}, 400 
+        except Exception:
             return {'message': "failed!"}, 500 
 
 class GetData(Resource):
     @auth_required
     def get(self):
-        # parameters
         try:
-            param = []
-            args_param = request.args
-
-            # start time to time now
-            if args_param.get('start-time') is None:
-                search_data = ''
-            else: 
-                if args_param.get('start-time') == '':
-                    return  {'message': "Error, incorrect date values"}, 400
-                if datetime_iso(args_param.get('start-time')) == True:
-                    param_1 = {"key": "created_at", "values": [f"{args_param.get('start-time')}"], "operator": "gt"}
-                    param.append(param_1)
-                else:
-                    return {'message': "Error, incorrect date values"}, 400
-            
-            # score >
-            if args_param.get('score') is None:
-                search_data = ''
-            else:
-                if args_param.get('score') == '':
-                    return {'message': "Error, incorrect date values"}, 400
-                if args_param.get('score').isnumeric() == True:
-                    param_2 = {"key": "x_opencti_score", "values": [f"{args_param.get('score')}"], "operator": "gt"}
-                    param.append(param_2)
-
-            # score <= 
-            if args_param.get('score-lte') is None:
-                search_data = ''
-            else:
-                if args_param.get('score-lte') == '':
-                    return {'message': "Error, incorrect date values"}, 400
-                if args_param.get('score-lte').isnumeric() == True:
-                    param_3 = {"key": "x_opencti_score", "values": [f"{args_param.get('score-lte')}"], "operator": "lte"}
-                    param.append(param_3)
-            
-            # search
-            if args_param.get('search') == None:
-                search_data = ''
-            else:
-                search_data = args_param.get('search')
-        except Exception as exp:
-            return  {'message': "Error, incorrect date values"}, 4001   
+            search_data, param = buildFilters(request.args)
+            after, first, fields = buildPagination(request.args)
+        except ValueError as exp:
+            return {'message': str(exp)}, 400
 
         # Core data
         try:
-            opencti_api_client = OpenCTIApiClient(config['opencti']['url'], getToken())
-            observables = opencti_api_client.stix_cyber_observable.list(search=str(search_data), getAll=False, filters=param, withPagination=True)
+            key = cache_key(getToken(), str(search_data), param, (after, first, fields))
+            entry = responses.get(key)
+            if entry is None:
+                entry = responses.put(key, listObservables(g.opencti_api_client, search_data, param, after, first, fields))
+            return cachedResponse(entry, 201)
+        except Exception:
+            return  {'message': "failed!"}, 500
+
+def listObservables(opencti_api_client, search_data, param, after, first, fields):
+    """Read one page of observables, as returned by /get-data"""
+    observables = opencti_api_client.stix_cyber_observable.list(search=str(search_data), first=first, after=after, filters=param, withPagination=True)
+    if fields is not None:
+        observables['entities'] = project(observables['entities'], fields)
+    pagination = observables['pagination']
+    return {
+        'data': observables,
+        'next_cursor': pagination['endCursor'] if pagination['hasNextPage'] else None,
+    }
+
+def project(entities, fields):
+    """Keep only some fields of observables"""
+    return [{field: entity[field] for field in fields if field in entity} for entity in entities]
+
+def exportObservables(opencti_api_client, search_data, param, data_format, compression):
+    """Start the export of observables, as returned by /get-file-stix2-data
+    :return: The chunks of the export, its file name and its mimetype
+    """
+    pages = iter_pages(
+        opencti_api_client,
+        str(search_data),
+        param,
+        page_size=int(api_config.get('export_page_size', 500)),
+    )
+    # Query the first page before answering, so failures still get a 500
+    pages = itertools.chain([next(pages)], pages)
+    chunks = iter_export(opencti_api_client, pages, data_format)
+    filename = 'data.ndjson' if data_format == 'ndjson' else 'data.json'
+    mimetype = EXPORT_MIMETYPES[data_format]
+    if compression == 'gzip':
+        chunks = iter_gzip(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return chunks, filename, mimetype
+
+def syncPage(opencti_api_client, search_data, param, state, first):
+    """Read the observables updated since a sync state, oldest first"""
+    filters = list(param)
+    if state.mark is not None:
+        filters.append({"key": "updated_at", "values": [state.mark], "operator": "gte"})
+    observables = opencti_api_client.stix_cyber_observable.list(
+        search=str(search_data),
+        filters=filters,
+        first=first + len(state.ids),
+        orderBy="updated_at",
+        orderMode="asc",
+        withPagination=True,
+    )
+    entities = unseen(state, observables['entities'])
+    has_more = observables['pagination']['hasNextPage'] or len(entities) > first
+    return entities[:first], has_more
+
+class SyncData(Resource):
+    @auth_required
+    def get(self):
+        try:
+            search_data, param = buildFilters(request.args)
+            _, first, fields = buildPagination(request.args)
+            state = decode_sync_token(request.args.get('sync-token'), filters_fingerprint(search_data, param))
+            wait = request.args.get('wait', '0')
+            if not wait.isnumeric():
+                raise ValueError("Error, incorrect wait value")
+            wait = min(int(wait), SYNC_MAX_WAIT)
+        except ValueError as exp:
+            return {'message': str(exp)}, 400
 
-            data_json = json.dumps(observables, indent=4)
-            data = json.loads(data_json)
-            return {'data': data}, 201
-        except Exception as exp:
+        # Core data
+        try:
+            deadline = time.monotonic() + wait
+            while True:
+                entities, has_more = syncPage(g.opencti_api_client, search_data, param, state, first)
+                # Long-poll: wait for new data until the deadline
+                if entities or time.monotonic() + SYNC_POLL_INTERVAL > deadline:
+                    break
+                time.sleep(SYNC_POLL_INTERVAL)
+            state = advance(state, entities)
+            if fields is not None:
+                entities = project(entities, fields)
+            return {'data': entities, 'sync_token': encode_sync_token(state), 'has_more': has_more}, 200
+        except Exception:
             return  {'message': "failed!"}, 500
 
 class GetFileData(Resource):
 
     @auth_required
     def get(self):
-        # parameters
         try:
-            param = []
-            args_param = request.args
-
-            # start time to time now
-            if args_param.get('start-time') is None:
-                search_data = ''
-            else: 
-                if args_param.get('start-time') == '':
-                    return  {'message': "Error, incorrect date values"}, 400
-                if datetime_iso(args_param.get('start-time')) == True:
-                    param_1 = {"key": "created_at", "values": [f"{args_param.get('start-time')}"], "operator": "gt"}
-                    param.append(param_1)
-                else:
-                    return {'message': "Error, incorrect date values"}, 400
-            
-            # score >
-            if args_param.get('score') is None:
-                search_data = ''
-            else:
-                if args_param.get('score') == '':
-                    return {'message': "Error, incorrect date values"}, 400
-                if args_param.get('score').isnumeric() == True:
-                    param_2 = {"key": "x_opencti_score", "values": [f"{args_param.get('score')}"], "operator": "gt"}
-                    param.append(param_2)
-
-            # score <= 
-            if args_param.get('score-lte') is None:
-                search_data = ''
-            else:
-                if args_param.get('score-lte') == '':
-                    return {'message': "Error, incorrect date values"}, 400
-                if args_param.get('score-lte').isnumeric() == True:
-                    param_3 = {"key": "x_opencti_score", "values": [f"{args_param.get('score-lte')}"], "operator": "lte"}
-                    param.append(param_3)
-            
-            # search
-            if args_param.get('search') == None:
-                search_data = ''
-            else:
-                search_data = args_param.get('search')
-        except Exception as exp:
-            return  {'message': "Error, incorrect date values"}, 400   
+            search_data, param = buildFilters(request.args)
+        except ValueError as exp:
+            return {'message': str(exp)}, 400
 
         # Core data
         try:
-            opencti_api_client = OpenCTIApiClient(config['opencti']['url'], getToken())
-            observables = opencti_api_client.stix_cyber_observable.list(search=str(search_data), getAll=True, filters=param)
-            data_json = json.dumps(observables, indent=4)
-            # Write the bundle
-            f = open("data.json", "w")
-            f.write(data_json)
-            f.close()
-            path = 'data.json'
-
-            return send_file(path, mimetype='application/json', as_attachment=True, conditional=True) 
+            data_format = request.args.get('format', 'json')
+            compression = request.args.get('compression')
+            if data_format not in EXPORT_FORMATS or compression not in (None, 'gzip'):
+                return {'message': 'unsupported format!'}, 400
+            chunks, filename, mimetype = exportObservables(g.opencti_api_client, search_data, param, data_format, compression)
+            response = app.response_class(chunks, mimetype=mimetype)
+            response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+            return response
             
-        except Exception as exp:
+        except Exception:
             return  {'message': "failed!"}, 500  
 
   
@@ -266,6 +490,7 @@ api.add_resource(PushData, '/push-data')
 api.add_resource(PushFileData, '/push-file-data')
 api.add_resource(GetData, '/get-data')
 api.add_resource(GetFileData, '/get-file-stix2-data')
+api.add_resource(SyncData, '/sync-data')
   
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port="5005", debug = True)
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""Append-only NDJSON spool written by the push endpoints
+
+Every token owns one active spool file under ``data/``. A push appends its
+own records, one JSON document per line, with a single ``write`` followed by
+an ``fsync``; nothing already in the file is read back or rewritten.
+
+The connector claims the active file by renaming it to a segment and then
+taking an exclusive ``flock`` on it. Writers hold a shared ``flock`` while
+appending and only write once they have checked that the file they opened is
+still the active one, so a push racing with a claim either lands in the
+claimed segment before the connector reads it, or in a fresh active file.
+"""
+
+import fcntl
+import json
+import os
+import re
+from typing import Iterable
+
+__all__ = [
+    "SPOOL_DIR",
+    "spool_path",
+    "encode_records",
+    "append_records",
+]
+
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def spool_path(token: str) -> str:
+    """Get the spool file of a token
+    :param token: Bearer token of the pushing user
+    :return: Path of the token spool file
+    """
+    if not token or not _TOKEN_RE.match(token):
+        raise ValueError("Invalid token")
+    return os.path.join(SPOOL_DIR, token)
+
+
+def encode_records(records: Iterable[dict]) -> bytes:
+    """Encode records as newline delimited JSON
+    :param records: Records to encode
+    :return: One line per record, newline terminated
+    """
+    return "".join(
+        json.dumps(record, ensure_ascii=False) + "\n" for record in records
+    ).encode("utf-8")
+
+
+def _write_all(fd: int, payload: bytes) -> None:
+    view = memoryview(payload)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _is_active(fd: int, path: str) -> bool:
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(fd)
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+
+def append_records(token: str, records: Iterable[dict]) -> int:
+    """Append records to the spool of a token and flush them to disk
+    :param token: Bearer token of the pushing user
+    :param records: Records to append
+    :return: Number of bytes appended
+    """
+    payload = encode_records(records)
+    if not payload:
+        return 0
+    path = spool_path(token)
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            if not _is_active(fd, path):
+                # Claimed by the connector since we opened it, retry on a fresh file
+                continue
+            _write_all(fd, payload)
+            os.fsync(fd)
+            return len(payload)
+        finally:
+            # Closing the descriptor also releases the lock
+            os.close(fd)
@@ -0,0 +1,103 @@
+"""Opaque tokens of the delta-sync feed
+
+A sync token records how far a client has read, as the ``updated_at``
+high-water mark of the last observable it received together with the ids
+of the observables it received at exactly that time. The next query asks
+for observables updated at or after the mark and drops those ids, so
+observables sharing a timestamp across two pages are neither lost nor
+repeated. The token also carries a fingerprint of the filters it was issued
+for, so it is not reused with another query. The client keeps the token;
+the server holds no state per client.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+from typing import List, NamedTuple, Optional
+
+__all__ = [
+    "SyncState",
+    "InvalidSyncToken",
+    "filters_fingerprint",
+    "encode_sync_token",
+    "decode_sync_token",
+    "unseen",
+    "advance",
+]
+
+
+class InvalidSyncToken(ValueError):
+    """A sync token is malformed or was issued for other filters"""
+
+
+class SyncState(NamedTuple):
+    mark: Optional[str]
+    ids: List[str]
+    filters: str
+
+
+def filters_fingerprint(search: str, filters: List[dict]) -> str:
+    """Short stable hash of the search and filters of a sync query"""
+    encoded = json.dumps([search, filters], sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def encode_sync_token(state: SyncState) -> str:
+    encoded = json.dumps([state.mark, state.ids, state.filters], separators=(",", ":"))
+    return base64.urlsafe_b64encode(encoded.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_sync_token(token: Optional[str], filters: str) -> SyncState:
+    """Decode the sync token of a request
+    :param token: Sync token sent by the client, None to start from the beginning
+    :param filters: Fingerprint of the filters of the request
+    :return: The state to resume from
+    """
+    if not token:
+        return SyncState(None, [], filters)
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        mark, ids, token_filters = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, TypeError, ValueError):
+        raise InvalidSyncToken("Error, invalid sync token")
+    if (
+        not isinstance(mark, str)
+        or not isinstance(ids, list)
+        or not all(isinstance(item, str) for item in ids)
+    ):
+        raise InvalidSyncToken("Error, invalid sync token")
+    if token_filters != filters:
+        raise InvalidSyncToken("Error, sync token was issued for other filters")
+    return SyncState(mark, ids, filters)
+
+
+def unseen(state: SyncState, entities: List[dict]) -> List[dict]:
+    """Drop the observables already received at the mark of a state
+
+    An id is only dropped while its ``updated_at`` is still the mark: an
+    observable updated again since it was received is returned again.
+    :param state: State the observables were read from
+    :param entities: Observables updated at or after the mark
+    :return: The observables the client has not received yet
+    """
+    seen = set(state.ids)
+    return [
+        entity for entity in entities
+        if not (entity["id"] in seen and entity["updated_at"] == state.mark)
+    ]
+
+
+def advance(state: SyncState, entities: List[dict]) -> SyncState:
+    """Move the state past observables, in ``updated_at`` order
+    :param state: State the observables were read from
+    :param entities: Observables returned to the client
+    :return: The state to resume from on the next query
+    """
+    if not entities:
+        return state
+    mark = entities[-1]["updated_at"]
+    ids = [entity["id"] for entity in entities if entity["updated_at"] == mark]
+    if mark == state.mark:
+        ids = state.ids + ids
+    return SyncState(mark, ids, state.filters)
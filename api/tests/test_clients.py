@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from clients import ClientPool, OpenCTIUnavailable, token_status
+
+
+class Factory:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def __call__(self, url, token):
+        self.calls += 1
+        if self.fail:
+            raise ValueError("OpenCTI API is not reachable")
+        return object()
+
+
+@pytest.mark.parametrize("status, body, expected", [
+    (200, {"data": {"me": {"id": "user"}}}, True),
+    (401, None, False),
+    (200, {"errors": [{"message": "You must be logged in", "extensions": {"code": "UNAUTHENTICATED"}}]}, False),
+    (200, {"errors": [{"message": "You must be logged in", "name": "AuthRequired"}]}, False),
+    (200, {"errors": [{"message": "Database timeout", "name": "DatabaseError"}]}, None),
+    (502, None, None),
+    (503, {"errors": []}, None),
+    (200, None, None),
+])
+def test_token_status(status, body, expected):
+    assert token_status(status, body) is expected
+
+
+def test_rejected_token_is_cached():
+    factory = Factory(fail=True)
+    pool = ClientPool("http://opencti", factory=factory, check=lambda url, token: False)
+    assert pool.get("bad") is None
+    assert pool.get("bad") is None
+    assert factory.calls == 1
+
+
+def test_outage_is_not_cached():
+    factory = Factory(fail=True)
+    pool = ClientPool("http://opencti", factory=factory, check=lambda url, token: None)
+    with pytest.raises(OpenCTIUnavailable):
+        pool.get("token")
+    factory.fail = False
+    assert pool.get("token") is not None
+    assert factory.calls == 2
+
+
+def test_validator_outage_is_not_cached():
+    aio = pytest.importorskip("aio")
+    answers = [None, True]
+
+    class Validator(aio.TokenValidator):
+        async def _check(self, token):
+            return answers.pop(0)
+
+    async def validate():
+        validator = Validator("http://opencti")
+        with pytest.raises(OpenCTIUnavailable):
+            await validator.is_valid("token")
+        return await validator.is_valid("token")
+
+    assert asyncio.run(validate()) is True
@@ -0,0 +1,94 @@
+import ast
+import io
+import os
+
+import pytest
+
+import spool
+from ingest import (
+    ALLOWED_LABELS,
+    MAX_DESCRIPTION_LENGTH,
+    MAX_VALUE_LENGTH,
+    RecordDefaults,
+    detect_format,
+    ingest,
+    validate_record,
+)
+
+
+@pytest.fixture(autouse=True)
+def spool_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, "SPOOL_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("record, reason", [
+    ({"value": "a.com", "label": ["Bạo lực"]}, None),
+    ({"value": "a.com", "label": []}, None),
+    ({"value": "a.com"}, "missing label"),
+    ({"value": "a.com", "label": "Bạo lực"}, "label is not a list"),
+    ({"value": "a.com", "label": ["nope"]}, "unknown label: nope"),
+    ({"value": "a" * 513, "label": []}, "value is longer than 512 characters"),
+    ({"value": "a.com", "label": [], "description": 1}, "description is not a string"),
+    ({"value": "a.com", "label": [], "description": "d" * 1025}, "description is longer than 1024 characters"),
+])
+def test_validate_record(record, reason):
+    assert validate_record(record) == reason
+
+
+def test_text_without_label_is_rejected():
+    result = ingest("token", io.BytesIO(b"a.com\nb.com\n"), "text")
+    assert (result.accepted, result.rejected) == (0, 2)
+    assert result.errors[0].message == "missing label"
+
+
+def test_text_with_default_label_is_accepted(spool_directory):
+    result = ingest("token", io.BytesIO(b"a.com\nb.com\n"), "text", defaults=RecordDefaults(label=["Bạo lực"]))
+    assert (result.accepted, result.rejected) == (2, 0)
+    assert len((spool_directory / "token").read_text().splitlines()) == 2
+
+
+def _lines(count):
+    return "".join(f"host{index}.com\n" for index in range(count)).encode("utf-8")
+
+
+def test_push_over_the_limits_spools_nothing(spool_directory):
+    defaults = RecordDefaults(label=["Bạo lực"])
+    result = ingest("token", io.BytesIO(_lines(2500)), "text", defaults=defaults, max_records=2000)
+    assert (result.accepted, result.too_large) == (0, "batch exceeds 2000 records")
+    result = ingest("token", io.BytesIO(_lines(2500)), "text", defaults=defaults, max_bytes=1024)
+    assert result.accepted == 0 and result.too_large is not None
+    assert not (spool_directory / "token").exists()
+
+
+def test_upload_without_limits_is_streamed(spool_directory):
+    result = ingest("token", io.BytesIO(_lines(2500)), "text", defaults=RecordDefaults(label=["Bạo lực"]))
+    assert (result.accepted, result.too_large) == (2500, None)
+    assert len((spool_directory / "token").read_text().splitlines()) == 2500
+
+
+@pytest.mark.parametrize("filename, mimetype, expected", [
+    ("feed", "text/csv", ("csv", None)),
+    ("feed", "text/csv; charset=utf-8", ("csv", None)),
+    ("feed.csv.gz", "application/gzip", ("csv", "gzip")),
+    ("feed.txt", "application/octet-stream", ("text", None)),
+    (None, "multipart/form-data", ("json", None)),
+])
+def test_detect_format(filename, mimetype, expected):
+    assert detect_format(filename, mimetype) == expected
+
+
+def test_rules_match_the_connector():
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "templateConnector", "classifier.py")
+    if not os.path.isfile(path):
+        pytest.skip("the connector is not checked out next to the API")
+    with open(path, encoding="utf-8") as classifier:
+        tree = ast.parse(classifier.read())
+    rules = {
+        node.targets[0].id: node.value
+        for node in tree.body
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)
+    }
+    assert set(ast.literal_eval(rules["ALLOWED_LABELS"].args[0])) == ALLOWED_LABELS
+    assert ast.literal_eval(rules["MAX_VALUE_LENGTH"]) == MAX_VALUE_LENGTH
+    assert ast.literal_eval(rules["MAX_DESCRIPTION_LENGTH"]) == MAX_DESCRIPTION_LENGTH
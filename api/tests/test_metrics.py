@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+import metrics
+
+CONNECTOR_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "..", "templateConnector")
+
+
+def test_metrics_module_matches_the_connector_copy():
+    path = os.path.join(CONNECTOR_DIRECTORY, "metrics.py")
+    if not os.path.isfile(path):
+        pytest.skip("the connector is not checked out next to the API")
+    with open(metrics.__file__, "rb") as api_copy, open(path, "rb") as connector_copy:
+        assert api_copy.read() == connector_copy.read()
+
+
+def test_label_values_are_escaped():
+    registry = metrics.Registry()
+    counter = metrics.Counter("pushes_total", "Pushes", ["tenant"], registry=registry)
+    counter.inc(tenant='a"b\\c\nd')
+    assert 'pushes_total{tenant="a\\"b\\\\c\\nd"} 1' in registry.render()
@@ -0,0 +1,69 @@
+import pytest
+
+from sync import (
+    InvalidSyncToken,
+    SyncState,
+    advance,
+    decode_sync_token,
+    encode_sync_token,
+    unseen,
+)
+
+
+class FakeStore:
+    """Observables as listed by OpenCTI: updated at or after a mark, oldest first"""
+
+    def __init__(self):
+        self.entities = {}
+
+    def put(self, stix_id, updated_at):
+        self.entities[stix_id] = {"id": stix_id, "updated_at": updated_at}
+
+    def sync(self, state, first=10):
+        listed = sorted(
+            (
+                entity for entity in self.entities.values()
+                if state.mark is None or entity["updated_at"] >= state.mark
+            ),
+            key=lambda entity: (entity["updated_at"], entity["id"]),
+        )
+        entities = unseen(state, listed)[:first]
+        return entities, advance(state, entities)
+
+
+def test_token_round_trip():
+    state = SyncState("2026-01-01T00:00:00Z", ["a", "b"], "filters")
+    assert decode_sync_token(encode_sync_token(state), "filters") == state
+
+
+def test_token_for_other_filters_is_refused():
+    token = encode_sync_token(SyncState("2026-01-01T00:00:00Z", [], "filters"))
+    with pytest.raises(InvalidSyncToken):
+        decode_sync_token(token, "other")
+
+
+def test_tied_timestamps_across_pages():
+    store = FakeStore()
+    for stix_id in "abc":
+        store.put(stix_id, "T1")
+    entities, state = store.sync(SyncState(None, [], "f"), first=2)
+    assert [entity["id"] for entity in entities] == ["a", "b"]
+    entities, state = store.sync(state, first=2)
+    assert [entity["id"] for entity in entities] == ["c"]
+    assert state.ids == ["a", "b", "c"]
+    entities, _ = store.sync(state)
+    assert entities == []
+
+
+def test_reupdated_tied_id_is_synced_again():
+    store = FakeStore()
+    store.put("a", "T1")
+    store.put("b", "T1")
+    entities, state = store.sync(SyncState(None, [], "f"))
+    assert [entity["id"] for entity in entities] == ["a", "b"]
+    store.put("a", "T5")
+    store.put("d", "T6")
+    entities, state = store.sync(state)
+    assert [(entity["id"], entity["updated_at"]) for entity in entities] == [("a", "T5"), ("d", "T6")]
+    assert state.mark == "T6"
+    assert store.sync(state)[0] == []
@@ -0,0 +1,311 @@
+"""Benchmark of the ingest pipeline, without OpenCTI
+
+Writes a synthetic spool, modelled on the demo data of ``data/*.save``, and
+runs it through the connector with a stand-in helper that records the
+bundles instead of sending them to OpenCTI. Every stage is measured on its
+own, batch by batch as ``Connector.run`` processes them:
+
+- read: ``readDataFromFile``, claiming and decoding the spool
+- validate: ``classify``
+- build: object construction and deduplication
+- serialize: ``iter_bundles``
+- send: ``send_bundles`` to the stand-in
+
+then the whole ``_process_batch`` is run again on a fresh copy of the spool
+(pipeline). Each pass starts from an empty, in-memory deduplication index,
+so the objects of a previous pass or run in the same ``--workdir`` are built
+again. Each stage reports its records per second and its peak RSS, and
+the serialize stage the size of the bundles:
+
+    python bench.py --dataset url --records 100000
+
+The connector options are read from ``config.yml`` and the environment as in
+production, e.g. ``CONNECTOR_FAST_BUILDER=true`` to measure the fast builder.
+The result is printed as JSON; given a previous result with ``--baseline``,
+the exit status is 1 if a stage is slower than it by more than
+``--tolerance``, to catch regressions.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import string
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Iterator, List
+
+from pycti import Identity
+
+from bundling import iter_bundles, send_bundles
+from classifier import ALLOWED_LABELS
+from dedupe import DedupeIndex
+from main import Connector
+
+DATASETS = {
+    "demo": {"url": 1},
+    "url": {"url": 8, "domain": 1, "ipv4": 1},
+    "domain": {"domain": 8, "url": 1, "ipv4": 1},
+    "ip": {"ipv4": 6, "ipv6": 2, "ipv4-network": 1, "ipv6-network": 1},
+    "mixed": {"url": 1, "domain": 1, "ipv4": 1, "ipv6": 1},
+}
+DEMO_HOSTS = ("this1sdomain.com", "onlyQuat.com", "lostm0ney88.xyz", "honpub.com")
+TOKEN = "bench"
+STAGES = ("read", "validate", "build", "serialize", "send", "pipeline")
+
+_LABELS = sorted(ALLOWED_LABELS)
+_TLDS = ("com", "net", "org", "xyz", "vn", "info")
+
+
+def _word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def _value(kind: str, index: int, rng: random.Random) -> str:
+    if kind == "url":
+        host = rng.choice(DEMO_HOSTS) if rng.random() < 0.5 else f"{_word(rng, 8)}.{rng.choice(_TLDS)}"
+        return f"{rng.choice(('http', 'https'))}://{host}/{_word(rng, 20)}{index}"
+    if kind == "domain":
+        return f"{_word(rng, 10)}{index}.{rng.choice(_TLDS)}"
+    if kind == "ipv4":
+        return f"{11 + (index >> 24) % 200}.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+    if kind == "ipv4-network":
+        return f"{11 + (index >> 16) % 200}.{(index >> 8) & 255}.{index & 255}.0/24"
+    if kind == "ipv6":
+        return f"2001:db8:{(index >> 16) & 0xffff:x}::{index & 0xffff:x}"
+    if kind == "ipv6-network":
+        return f"2001:db8:{(index >> 16) & 0xffff:x}:{index & 0xffff:x}::/64"
+    raise ValueError(f"Unknown kind of value: {kind}")
+
+
+def generate_records(dataset: str, count: int, invalid: float = 0.0, seed: int = 0) -> Iterator[dict]:
+    """Generate records shaped like the pushes of the demo data
+    :param dataset: Mix of kinds of values, one of ``DATASETS``
+    :param count: Number of records
+    :param invalid: Share of records carrying an unknown label, rejected by validation
+    :param seed: Seed of the generator, for reproducible spools
+    :return: Records, as pushed to the API
+    """
+    rng = random.Random(seed)
+    kinds, weights = zip(*DATASETS[dataset].items())
+    for index in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        labels = rng.sample(_LABELS, rng.choice((1, 1, 1, 2, 3)))
+        if rng.random() < invalid:
+            labels = labels + ["unknown"]
+        record = {"value": _value(kind, index, rng), "description": "Demo data", "label": labels}
+        if rng.random() < 0.3:
+            record["score"] = rng.randint(0, 100)
+        yield record
+
+
+def write_spool(directory: str, records: Iterator[dict]) -> int:
+    """Write records into the spool of the benchmark token, as the push API does
+    :return: Bytes written
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, TOKEN), "w", encoding="utf-8") as spool:
+        for record in records:
+            spool.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return spool.tell()
+
+
+class _Work:
+    def initiate_work(self, connector_id: str, friendly_name: str) -> str:
+        return f"work_{uuid.uuid4()}"
+
+
+class _Identity:
+    def create(self, **kwargs) -> dict:
+        standard_id = Identity.generate_id(kwargs["name"], kwargs["type"].lower())
+        return {"id": str(uuid.uuid4()), "standard_id": standard_id}
+
+
+class _Api:
+    def __init__(self):
+        self.work = _Work()
+        self.identity = _Identity()
+
+    def health_check(self) -> bool:
+        return True
+
+
+class StandInHelper:
+    """Connector helper recording the bundles instead of sending them to OpenCTI"""
+
+    connect_id = "bench"
+    opencti_url = "http://opencti.invalid"
+
+    def __init__(self, confidence_level: int = 50):
+        self.connect_confidence_level = confidence_level
+        self.api = _Api()
+        self.bundle_sizes: List[int] = []
+
+    def send_stix2_bundle(self, bundle: str, **kwargs) -> list:
+        self.bundle_sizes.append(len(bundle.encode("utf-8")))
+        return []
+
+    def log_info(self, message: str) -> None:
+        pass
+
+    def log_error(self, message: str) -> None:
+        print(message, file=sys.stderr)
+
+
+def _reset_peak_rss() -> None:
+    # Linux only: reset the peak RSS of the process to its current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Stage:
+    def __init__(self):
+        self.seconds = 0.0
+        self.peak_rss_mb = 0.0
+
+    def __enter__(self):
+        _reset_peak_rss()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._started
+        self.peak_rss_mb = max(self.peak_rss_mb, _peak_rss_mb())
+
+    def report(self, records: int) -> dict:
+        return {
+            "seconds": round(self.seconds, 3),
+            "records_per_second": round(records / self.seconds, 1) if self.seconds else None,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+
+
+def _forget_sent(connector: Connector) -> None:
+    # An empty index with the configured limits, not persisted in the workdir
+    dedupe = connector._dedupe
+    connector._dedupe = DedupeIndex(None, capacity=dedupe._capacity, ttl=dedupe._ttl)
+
+
+def run(dataset: str, count: int, invalid: float, seed: int, directory: str) -> dict:
+    spool_directory = os.path.join(directory, "data")
+    spool_bytes = write_spool(spool_directory, generate_records(dataset, count, invalid, seed))
+    helper = StandInHelper()
+    connector = Connector(helper, directory)
+    _forget_sent(connector)
+    stages: Dict[str, _Stage] = {name: _Stage() for name in STAGES}
+    records = valid = objects = 0
+    bundle_sizes = []
+    while True:
+        with stages["read"]:
+            batches, err = connector.readDataFromFile()
+        if err is not None:
+            raise err
+        if not batches:
+            break
+        for batch in batches:
+            records += len(batch.records)
+            with stages["validate"]:
+                partitions = connector._classify(connector._tenant(batch.token), batch.records)
+            valid += sum(len(kind) for kind in partitions[:4])
+            with stages["build"]:
+                bundle_objects = connector._create_bundle_objects(partitions)
+            objects += len(bundle_objects)
+            with stages["serialize"]:
+                bundles = list(iter_bundles(
+                    bundle_objects,
+                    max_objects=connector._bundle_max_objects,
+                    max_bytes=connector._bundle_max_bytes,
+                    serialize=connector._builder.serialize,
+                ))
+            bundle_sizes.extend(len(bundle.encode("utf-8")) for bundle in bundles)
+            del bundle_objects
+            with stages["send"]:
+                send_bundles(helper.send_stix2_bundle, bundles)
+            del bundles
+            connector._scheduler.ack(batch)
+
+    # The whole pipeline, with serialization overlapping the sends
+    write_spool(spool_directory, generate_records(dataset, count, invalid, seed))
+    _forget_sent(connector)
+    while True:
+        with stages["pipeline"]:
+            batches, err = connector.readDataFromFile()
+            for batch in batches or []:
+                connector._process_batch(batch)
+                connector._scheduler.ack(batch)
+        if err is not None:
+            raise err
+        if not batches:
+            break
+
+    return {
+        "dataset": dataset,
+        "records": records,
+        "valid_records": valid,
+        "objects": objects,
+        "spool_bytes": spool_bytes,
+        "bundles": {
+            "count": len(bundle_sizes),
+            "total_bytes": sum(bundle_sizes),
+            "max_bytes": max(bundle_sizes, default=0),
+            "mean_bytes": round(sum(bundle_sizes) / len(bundle_sizes)) if bundle_sizes else 0,
+        },
+        "stages": {name: stage.report(records) for name, stage in stages.items()},
+    }
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Stages slower than in the baseline by more than the tolerance"""
+    slower = []
+    for name, stage in baseline.get("stages", {}).items():
+        current = result["stages"].get(name, {}).get("records_per_second")
+        previous = stage.get("records_per_second")
+        if current and previous and current < previous * (1 - tolerance):
+            slower.append(f"{name}: {current} records/s, baseline {previous}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dataset", choices=sorted(DATASETS), default="mixed")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--invalid", type=float, default=0.01, help="share of records rejected by validation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directory of the spool and state, temporary by default")
+    parser.add_argument("--baseline", help="previous result to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown allowed against the baseline")
+    args = parser.parse_args()
+    if args.workdir:
+        result = run(args.dataset, args.records, args.invalid, args.seed, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="connector-bench-") as directory:
+            result = run(args.dataset, args.records, args.invalid, args.seed, directory)
+    print(json.dumps(result, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            slower = regressions(result, json.load(baseline_file), args.tolerance)
+        for line in slower:
+            print(f"Regression, {line}", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
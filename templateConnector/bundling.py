@@ -0,0 +1,81 @@
+"""Size-bounded STIX2 bundles and pipelined sending"""
+
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List
+
+__all__ = [
+    "serialize_bundle",
+    "iter_bundles",
+    "send_bundles",
+]
+
+
+def serialize_bundle(serialized_objects: List[str]) -> str:
+    """Wrap already serialized objects into a serialized STIX2 bundle
+    :param serialized_objects: Serialized STIX2 objects
+    :return: The serialized bundle, as ``stix2.Bundle(...).serialize()`` would produce it
+    """
+    return (
+        f'{{"type": "bundle", "id": "bundle--{uuid.uuid4()}", "objects": ['
+        + ", ".join(serialized_objects)
+        + "]}"
+    )
+
+
+def iter_bundles(
+    objects: Iterable,
+    max_objects: int = 0,
+    max_bytes: int = 0,
+    serialize: Callable[[object], str] = lambda obj: obj.serialize(),
+) -> Iterator[str]:
+    """Serialize objects into bundles bounded by object count and byte size
+
+    Objects are serialized one at a time, so the cost of a chunk is only paid
+    when the consumer asks for it. An object larger than ``max_bytes`` is sent
+    alone in its own bundle.
+    :param objects: STIX2 objects, in sending order
+    :param max_objects: Maximum number of objects per bundle, 0 for no limit
+    :param max_bytes: Maximum serialized size of the objects of a bundle, 0 for no limit
+    :param serialize: Serializes one object
+    :return: Serialized bundles
+    """
+    chunk = []
+    chunk_bytes = 0
+    for obj in objects:
+        serialized = serialize(obj)
+        size = len(serialized.encode("utf-8"))
+        if chunk and (
+            (max_objects and len(chunk) >= max_objects)
+            or (max_bytes and chunk_bytes + size > max_bytes)
+        ):
+            yield serialize_bundle(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(serialized)
+        chunk_bytes += size
+    if chunk:
+        yield serialize_bundle(chunk)
+
+
+def send_bundles(send: Callable[[str], object], bundles: Iterable[str]) -> int:
+    """Send bundles while the next one is being serialized
+
+    At most one bundle is in flight: the next bundle is pulled from
+    ``bundles`` (and therefore serialized) while the previous one is being
+    sent, and is only submitted once that send has completed.
+    :param send: Sends one serialized bundle
+    :param bundles: Serialized bundles, usually from ``iter_bundles``
+    :return: Number of bundles sent
+    """
+    count = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for bundle in bundles:
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(send, bundle)
+            count += 1
+        if pending is not None:
+            pending.result()
+    return count
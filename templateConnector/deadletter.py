@@ -0,0 +1,49 @@
+"""Dead-letter files of the records that could not be sent
+
+A record that keeps failing while the other records of its batch go
+through is set aside instead of blocking the spool of its tenant. It is
+appended, with the error and the time, to the NDJSON dead-letter file of
+the tenant, from which it can be inspected and pushed again.
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+__all__ = [
+    "DeadLetters",
+]
+
+
+class DeadLetters:
+    """Directory of the dead-letter files, one per tenant"""
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Directory of the dead-letter files
+        """
+        self._directory = directory
+
+    def path(self, tenant: str) -> str:
+        return os.path.join(self._directory, f"{tenant}.ndjson")
+
+    def write(self, tenant: str, failures: List[Tuple[dict, str]]) -> None:
+        """Append records to the dead-letter file of a tenant
+        :param tenant: Fingerprint of the tenant token
+        :param failures: Records, each with the error it failed with
+        """
+        if not failures:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        payload = "".join(
+            json.dumps({"time": now, "error": error, "record": record}, ensure_ascii=False) + "\n"
+            for record, error in failures
+        ).encode("utf-8")
+        os.makedirs(self._directory, exist_ok=True)
+        fd = os.open(self.path(tenant), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, payload)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
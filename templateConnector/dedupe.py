@@ -0,0 +1,146 @@
+"""Deduplication of STIX2 objects within and across bundles
+
+Objects are keyed by their deterministic STIX id. Within a batch only the
+first object with a given id is kept. Across batches, the ids sent recently
+are remembered in a bounded LRU with a TTL, together with a fingerprint of
+the record they were built from, so resubmitting the same record is skipped
+while a change of score, labels or description still goes through.
+
+The index is persisted to disk so it survives restarts, as a snapshot and
+an append-only log: a commit appends the ids of its batch to the log, and
+once the log holds ``capacity`` entries it is compacted into a new snapshot.
+The log is not fsynced, losing its tail only resends a few objects.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+__all__ = [
+    "fingerprint",
+    "DedupeIndex",
+]
+
+
+def fingerprint(*fields) -> str:
+    """Short stable hash of the fields an object was built from"""
+    encoded = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class DedupeIndex:
+    """Ids of the objects already bundled, in this batch and in recent ones"""
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 100000, ttl: int = 86400):
+        """
+        :param path: File persisting the index, None to keep it in memory
+        :param capacity: Maximum number of ids remembered across batches, 0 to disable
+        :param ttl: Seconds an id is remembered after it was last sent
+        """
+        self._path = path
+        self._capacity = capacity
+        self._ttl = ttl
+        self._sent: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._batch: Dict[str, str] = {}
+        self._logged = 0
+        if path is not None and capacity > 0:
+            self._load()
+
+    def start_batch(self) -> None:
+        """Forget the ids of the previous batch if it was not committed"""
+        self._batch = {}
+
+    def is_new(self, stix_id: str, digest: str) -> bool:
+        """Check an object and remember it for the current batch
+        :param stix_id: Deterministic STIX id of the object
+        :param digest: Fingerprint of the record the object was built from
+        :return: False if the object is already in the batch, or was recently sent unchanged
+        """
+        if stix_id in self._batch:
+            return False
+        sent = self._sent.get(stix_id)
+        if sent is not None and sent[0] == digest and sent[1] > time.time():
+            self._sent.move_to_end(stix_id)
+            return False
+        self._batch[stix_id] = digest
+        return True
+
+    def commit(self) -> None:
+        """Remember the ids of the current batch once it has been sent"""
+        if self._capacity <= 0:
+            self._batch = {}
+            return
+        expires = time.time() + self._ttl
+        for stix_id, digest in self._batch.items():
+            self._sent[stix_id] = (digest, expires)
+            self._sent.move_to_end(stix_id)
+        batch, self._batch = self._batch, {}
+        while len(self._sent) > self._capacity:
+            self._sent.popitem(last=False)
+        if self._path is not None and batch:
+            if self._logged + len(batch) >= self._capacity:
+                self._save()
+            else:
+                self._append(batch, expires)
+
+    def _load(self) -> None:
+        try:
+            with open(self._path, "r", encoding="utf-8") as index_file:
+                entries = json.load(index_file)
+        except (OSError, ValueError):
+            entries = []
+        now = time.time()
+        for stix_id, digest, expires in entries[-self._capacity:]:
+            if expires > now:
+                self._sent[stix_id] = (digest, expires)
+        torn = False
+        try:
+            with open(self._path + ".log", "r", encoding="utf-8") as log_file:
+                for line in log_file:
+                    try:
+                        stix_id, digest, expires = json.loads(line)
+                    except ValueError:
+                        torn = True
+                        continue
+                    self._logged += 1
+                    if expires > now:
+                        self._sent[stix_id] = (digest, expires)
+                        self._sent.move_to_end(stix_id)
+        except OSError:
+            return
+        while len(self._sent) > self._capacity:
+            self._sent.popitem(last=False)
+        # A crash tore the last line, appending after it would corrupt the next one
+        if torn:
+            self._save()
+
+    def _append(self, batch: Dict[str, str], expires: float) -> None:
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path + ".log", "a", encoding="utf-8") as log_file:
+            log_file.writelines(
+                json.dumps([stix_id, digest, expires], separators=(",", ":")) + "\n"
+                for stix_id, digest in batch.items()
+            )
+        self._logged += len(batch)
+
+    def _save(self) -> None:
+        now = time.time()
+        entries = [
+            [stix_id, digest, expires]
+            for stix_id, (digest, expires) in self._sent.items()
+            if expires > now
+        ]
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as index_file:
+            json.dump(entries, index_file, separators=(",", ":"))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temporary_path, self._path)
+        # The snapshot holds every logged entry, a crash before this only replays them again
+        with open(self._path + ".log", "w", encoding="utf-8"):
+            pass
+        self._logged = 0
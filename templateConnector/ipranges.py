@@ -0,0 +1,81 @@
+"""Compact sets of IPv4/IPv6 addresses and networks
+
+Addresses and CIDR networks are kept as ``(network, prefix length)``
+integers, so a batch of millions of IP records is deduplicated without
+creating an ``ipaddress`` object per entry. Only identical entries are
+merged, e.g. ``10.0.0.1`` and ``10.0.0.1/32``: an address inside a network of
+the same batch is a distinct entry, with its own record.
+"""
+
+import socket
+from typing import Dict, Generic, Iterator, Tuple, TypeVar
+
+__all__ = [
+    "AddressSet",
+]
+
+T = TypeVar("T")
+
+_FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+
+class AddressSet(Generic[T]):
+    """Deduplicated set of addresses and networks of one IP version
+
+    Each entry keeps the item it was first added with, e.g. the record
+    carrying its description and labels.
+    """
+
+    def __init__(self, version: int):
+        """
+        :param version: 4 or 6
+        """
+        self._family, self._bits = _FAMILIES[version]
+        self._entries: Dict[Tuple[int, int], T] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def parse(self, value: str) -> Tuple[int, int]:
+        """Parse an address or a CIDR network
+        :param value: e.g. ``10.0.0.1`` or ``10.0.0.0/24``
+        :return: Network address as an integer and prefix length
+        :raises ValueError: If the value is not an address or network of this version
+        """
+        address, _, prefix = value.partition("/")
+        try:
+            packed = socket.inet_pton(self._family, address)
+        except OSError:
+            raise ValueError(f"Invalid address: {value}")
+        if prefix and not prefix.isdigit():
+            raise ValueError(f"Invalid prefix length: {value}")
+        length = int(prefix) if prefix else self._bits
+        if length > self._bits:
+            raise ValueError(f"Invalid prefix length: {value}")
+        host_bits = self._bits - length
+        network = int.from_bytes(packed, "big") >> host_bits << host_bits
+        return network, length
+
+    def format(self, network: int, length: int) -> str:
+        """Format a network in canonical form, without prefix for single addresses"""
+        address = socket.inet_ntop(self._family, network.to_bytes(self._bits // 8, "big"))
+        return address if length == self._bits else f"{address}/{length}"
+
+    def add(self, value: str, item: T) -> bool:
+        """Add an address or a network
+        :param value: e.g. ``10.0.0.1`` or ``10.0.0.0/24``
+        :param item: Kept with the entry if it is new
+        :return: False if the entry was already in the set
+        """
+        key = self.parse(value)
+        if key in self._entries:
+            return False
+        self._entries[key] = item
+        return True
+
+    def __iter__(self) -> Iterator[Tuple[str, T]]:
+        """Iterate over the entries, in address order
+        :return: Canonical value and item of each entry
+        """
+        for network, length in sorted(self._entries):
+            yield self.format(network, length), self._entries[network, length]
@@ -2,47 +2,71 @@ import os
 import sys
 import pytz
 import time
-import json
+import hashlib
+from contextlib import contextmanager
 from datetime import datetime
 
+import pika
 import stix2
 import yaml
-import pycti
-import validators
-from urllib.parse import urlparse
-from typing import Iterator, NamedTuple, Optional
-from stix2.v21 import _Observable as Observable 
-from pycti import OpenCTIConnectorHelper, get_config_variable, Identity
-from patterns import (
-    IndicatorPattern,
-    create_indicator_pattern_domain_name,
-    create_indicator_pattern_url,
-)
+from collections import Counter
+from typing import List
+from pycti import OpenCTIConnectorHelper, get_config_variable
+from pycti.connector.opencti_connector_helper import create_ssl_context
+from builder import FastStixBuilder, StixBuilder, build_objects
+from bundling import iter_bundles, send_bundles
+from classifier import Partitions, Rejected, classify
+from deadletter import DeadLetters
+from dedupe import DedupeIndex
+from metrics import REGISTRY, Counter as MetricCounter, Gauge, Histogram
+from parallel import ParallelBuilder
+from profiling import BatchProfiler
+from resolution import ResolutionCache
+from scheduler import SpoolScheduler, TenantBatch
+from watcher import SpoolWatcher
 
+RECORDS_READ = MetricCounter("connector_records_read_total", "Records read from the spool")
+RECORDS_VALID = MetricCounter("connector_records_valid_total", "Records that passed validation")
+RECORDS_REJECTED = MetricCounter("connector_records_rejected_total", "Records rejected, by reason", ["reason"])
+OBJECTS_BUILT = MetricCounter("connector_objects_built_total", "STIX2 objects built from valid records")
+OBJECTS_DEDUPLICATED = MetricCounter("connector_objects_deduplicated_total", "Built objects skipped as already sent")
+BATCHES_FAILED = MetricCounter("connector_batches_failed_total", "Tenant batches that failed and will be retried")
+RECORDS_DEAD_LETTERED = MetricCounter("connector_records_dead_lettered_total", "Records moved to a dead-letter file")
+STAGE_SECONDS = Histogram(
+    "connector_stage_seconds",
+    "Wall time of the pipeline stages: read per round, classify and build per batch, serialize and send per bundle",
+    ["stage"],
+)
+BUNDLE_BYTES = Histogram(
+    "connector_bundle_bytes",
+    "Size of the serialized bundles sent",
+    buckets=[2 ** exponent for exponent in range(10, 27, 2)],
+)
+SPOOL_DEPTH_BYTES = Gauge("connector_spool_depth_bytes", "Bytes waiting in the spool of each tenant", ["tenant"])
+SPOOL_AGE_SECONDS = Gauge(
+    "connector_spool_age_seconds", "Time since the oldest waiting file of each tenant was written", ["tenant"]
+)
+SPOOL_DRAIN_RATE_BYTES = Gauge("connector_spool_drain_rate_bytes", "Bytes of spool processed per second")
 
-import string
-import random
-import ssl
-import urllib.request
-import certifi
-import csv
 
-class Observation(NamedTuple):
-    """Result from making an observable"""
+class SendError(Exception):
+    """OpenCTI or its RabbitMQ failed to take a bundle, whatever records it holds"""
 
-    observable: Observable
-    indicator: stix2.Indicator = None
-    relationship: stix2.Relationship = None
 
 class Connector:
-    def __init__(self):
+    def __init__(self, helper: OpenCTIConnectorHelper = None, directory: str = None):
+        """
+        :param helper: Helper to talk to OpenCTI, built from the config if not given
+        :param directory: Directory of ``data/`` and ``state/``, the one of this file by default
+        """
         config_file_path = os.path.dirname(os.path.abspath(__file__)) + "/config.yml"
         self.config = (
             yaml.load(open(config_file_path), Loader=yaml.FullLoader)
             if os.path.isfile(config_file_path)
             else {}
         )
-        self.helper = OpenCTIConnectorHelper(self.config)
+        self.helper = helper if helper is not None else OpenCTIConnectorHelper(self.config)
+        directory = directory or os.path.dirname(os.path.abspath(__file__))
         self.cve_interval = get_config_variable(
             "TEMPLATE_ATTRIBUTE", ["template", "attribute"], self.config, True
         )
@@ -55,10 +79,18 @@ class Connector:
         self._default_tlp = getattr(stix2, f"TLP_{default_tlp}".upper(), None)
         if not isinstance(self._default_tlp, stix2.MarkingDefinition):
             raise ValueError(f"Invalid tlp: {default_tlp}")
-        self._identity = self.helper.api.identity.create(
-            type="Organization",
-            name="VNCERT",
-            description="VNCERT CTI DEMO",
+        resolutions = ResolutionCache(
+            os.path.join(directory, "state", "resolutions.json"),
+            ttl=get_config_variable(
+                "CONNECTOR_RESOLUTION_TTL",
+                ["connector", "resolution_ttl"],
+                self.config,
+                True,
+                default=7 * 86400,
+            ),
+        )
+        self._identity = resolutions.get(
+            f"{self.helper.opencti_url} identity Organization VNCERT", self._create_identity
         )
         self._create_indicators = get_config_variable(
             "URLSCAN_CREATE_INDICATORS",
@@ -72,291 +104,465 @@ class Connector:
             self.config,
             True,
         )
+        self._tenant_label = get_config_variable(
+            "CONNECTOR_TENANT_LABEL",
+            ["connector", "tenant_label"],
+            self.config,
+            default=True,
+        )
         self._update_existing_data = get_config_variable(
             "URLSCAN_UPDATE_EXISTING_DATA",
             ["urlscan", "update_existing_data"],
             self.config,
             default=False,
         ) 
+        fast_builder = get_config_variable(
+            "CONNECTOR_FAST_BUILDER",
+            ["connector", "fast_builder"],
+            self.config,
+            default=False,
+        )
+        self._builder = (FastStixBuilder if fast_builder else StixBuilder)(
+            self._identity["standard_id"],
+            self._default_tlp,
+            create_indicators=self._create_indicators,
+        )
+        build_workers = get_config_variable(
+            "CONNECTOR_BUILD_WORKERS",
+            ["connector", "build_workers"],
+            self.config,
+            True,
+            default=0,
+        )
+        self._parallel_threshold = get_config_variable(
+            "CONNECTOR_PARALLEL_THRESHOLD",
+            ["connector", "parallel_threshold"],
+            self.config,
+            True,
+            default=20000,
+        )
+        self._parallel_builder = (
+            ParallelBuilder(self._builder, build_workers) if build_workers > 1 else None
+        )
+        self._bundle_max_objects = get_config_variable(
+            "CONNECTOR_BUNDLE_MAX_OBJECTS",
+            ["connector", "bundle_max_objects"],
+            self.config,
+            True,
+            default=5000,
+        )
+        self._bundle_max_bytes = get_config_variable(
+            "CONNECTOR_BUNDLE_MAX_BYTES",
+            ["connector", "bundle_max_bytes"],
+            self.config,
+            True,
+            default=10 * 1024 * 1024,
+        )
+        self._dedupe = DedupeIndex(
+            os.path.join(directory, "state", "dedupe.json"),
+            capacity=get_config_variable(
+                "CONNECTOR_DEDUPE_CAPACITY",
+                ["connector", "dedupe_capacity"],
+                self.config,
+                True,
+                default=100000,
+            ),
+            ttl=get_config_variable(
+                "CONNECTOR_DEDUPE_TTL",
+                ["connector", "dedupe_ttl"],
+                self.config,
+                True,
+                default=86400,
+            ),
+        )
+        spool_directory = os.path.join(directory, "data")
+        self._scheduler = SpoolScheduler(
+            spool_directory,
+            budget_bytes=get_config_variable(
+                "CONNECTOR_TENANT_BUDGET_BYTES",
+                ["connector", "tenant_budget_bytes"],
+                self.config,
+                True,
+                default=4 * 1024 * 1024,
+            ),
+            segment_max_bytes=get_config_variable(
+                "CONNECTOR_SEGMENT_MAX_BYTES",
+                ["connector", "segment_max_bytes"],
+                self.config,
+                True,
+                default=1024 * 1024,
+            ),
+            weighted=get_config_variable(
+                "CONNECTOR_TENANT_WEIGHTED",
+                ["connector", "tenant_weighted"],
+                self.config,
+                default=False,
+            ),
+            retry_base=get_config_variable(
+                "CONNECTOR_RETRY_BASE",
+                ["connector", "retry_base"],
+                self.config,
+                True,
+                default=5,
+            ),
+            retry_max=get_config_variable(
+                "CONNECTOR_RETRY_MAX",
+                ["connector", "retry_max"],
+                self.config,
+                True,
+                default=300,
+            ),
+        )
+        self._max_attempts = get_config_variable(
+            "CONNECTOR_MAX_ATTEMPTS",
+            ["connector", "max_attempts"],
+            self.config,
+            True,
+            default=5,
+        )
+        self._dead_letters = DeadLetters(
+            os.path.join(directory, "state", "dead-letter")
+        )
+        self._metrics_file = get_config_variable(
+            "CONNECTOR_METRICS_FILE",
+            ["connector", "metrics_file"],
+            self.config,
+            default=os.path.join(directory, "state", "metrics.prom"),
+        )
+        self._profiler = BatchProfiler(
+            get_config_variable(
+                "CONNECTOR_PROFILE_DIRECTORY",
+                ["connector", "profile_directory"],
+                self.config,
+                default=os.path.join(directory, "state", "profiles"),
+            ),
+            every=get_config_variable(
+                "CONNECTOR_PROFILE_EVERY",
+                ["connector", "profile_every"],
+                self.config,
+                True,
+                default=0,
+            ),
+            keep=get_config_variable(
+                "CONNECTOR_PROFILE_KEEP",
+                ["connector", "profile_keep"],
+                self.config,
+                True,
+                default=100,
+            ),
+            log=self.helper.log_info,
+        )
+        self._watcher = SpoolWatcher(
+            spool_directory,
+            mode=get_config_variable(
+                "CONNECTOR_WATCH_MODE",
+                ["connector", "watch_mode"],
+                self.config,
+                default="auto",
+            ),
+            debounce=get_config_variable(
+                "CONNECTOR_WATCH_DEBOUNCE_MS",
+                ["connector", "watch_debounce_ms"],
+                self.config,
+                True,
+                default=500,
+            ) / 1000,
+            min_interval=get_config_variable(
+                "CONNECTOR_POLL_MIN_INTERVAL",
+                ["connector", "poll_min_interval"],
+                self.config,
+                True,
+                default=1,
+            ),
+            max_interval=get_config_variable(
+                "CONNECTOR_POLL_MAX_INTERVAL",
+                ["connector", "poll_max_interval"],
+                self.config,
+                True,
+                default=10,
+            ),
+        )
+        self.helper.log_info(f"Waiting for spool data in {self._watcher.mode} mode")
+
+    def _create_identity(self) -> dict:
+        """Create, or find, the author identity in OpenCTI
+        :return: Its internal and standard ids
+        """
+        identity = self.helper.api.identity.create(
+            type="Organization",
+            name="VNCERT",
+            description="VNCERT CTI DEMO",
+        )
+        return {"id": identity["id"], "standard_id": identity["standard_id"]}
 
     def run(self):
         while True:
-            dataArray, err = self.readDataFromFile()
+            batches, err = self.readDataFromFile()
+            had_data = False
             if err is None:
-                bundle_objects = []
-                for _data in dataArray:
+                for batch in batches:
+                    had_data = had_data or len(batch.records) > 0
                     try:
-                        if len('value') > 512 or len('description') > 1024:
-                            continue
-                        if "score" not in _data or _data['score'] < 0 or _data['score'] > 100:
-                            _data['score'] = self.helper.connect_confidence_level
-                        if type(_data['label']) != list:
-                            continue
-                        else:
-                            errFlag = False
-                            for label in _data['label']:
-                                if label not in ["Cờ bạc", "Tình dục", "Chất kích thích", "Vũ khí nguy hiểm", "Bạo lực"]:
-                                    errFlag = True
-                            if errFlag:
-                                continue
-                            
-                        if validators.url(_data['value']):
-                            obs1 = self._create_url_observable(
-                                _data['value'], _data['description'], _data['label'], _data['score']
-                            )
-                            bundle_objects.extend(filter(None, [*obs1]))
-                            hostname = urlparse(_data['value']).hostname
-                            obs2 = self._create_domain_observable(
-                                hostname, _data['description'], _data['label'], _data['score']
-                            )
-                            bundle_objects.extend(filter(None, [*obs2]))
-                            rels = self._create_observation_relationships(
-                                obs1, obs2, _data['description'], _data['label'], _data['score']
-                            )
-                            bundle_objects.extend(rels)
-                        elif validators.domain(_data['value']):
-                            if type(_data['label']) != list:
-                                continue
-                            obs = self._create_domain_observable(
-                                _data['value'], _data['description'], _data['label'], _data['score']
-                            )
-                            bundle_objects.extend(filter(None, [*obs]))
-                        elif validators.ipv4(_data['value']):
-                            if type(_data['label']) != list:
-                                continue
-                            # TODO
-                        elif validators.ipv6(_data['value']):
-                            if type(_data['label']) != list:
-                                continue
-                            # TODO
-                    except:
+                        with self._profiler.batch(self._tenant(batch.token), len(batch.records)):
+                            self._process_batch(batch)
+                        # Lines of the spool that could not even be decoded, kept
+                        # before the ack deletes them from the spool
+                        self._dead_letters.write(
+                            self._tenant(batch.token), [(err.line, str(err)) for err in batch.errors]
+                        )
+                    except Exception as exp:
+                        BATCHES_FAILED.inc()
+                        attempts, delay = self._scheduler.fail(batch)
+                        self.helper.log_error(
+                            f"Failed to send the batch of tenant {self._tenant(batch.token)}"
+                            f" (attempt {attempts}), retrying in {delay:g}s [{exp}]"
+                        )
                         continue
-                if len(bundle_objects) == 0:
-                    self.helper.log_info("No objects to bundle")
-                    time.sleep(10)
-                    continue
-                now = datetime.now(pytz.UTC)
-                friendly_name = "vncert run @ " + now.astimezone(pytz.UTC).isoformat()
-                work_id = self.helper.api.work.initiate_work(
-                    self.helper.connect_id, friendly_name
-                )
-                bundle = stix2.Bundle(objects=bundle_objects, allow_custom=True).serialize()
-                self.helper.log_info("Sending event STIX2 bundle")
+                    RECORDS_DEAD_LETTERED.inc(len(batch.errors))
+                    self._scheduler.ack(batch)
+            self._export_metrics()
+            if err is None and self._scheduler.has_backlog():
+                continue
+            self._watcher.wait(had_data)
 
-                self.helper.send_stix2_bundle(
-                    bundle, 
-                    work_id=work_id,
-                    update=self._update_existing_data,
-                )
-            time.sleep(10)
+    def _export_metrics(self) -> None:
+        """Update the spool gauges and write every metric to the textfile, if enabled"""
+        now = time.time()
+        depths = self._scheduler.depths()
+        SPOOL_DEPTH_BYTES.replace({(self._tenant(token),): size for token, (size, _) in depths.items()})
+        SPOOL_AGE_SECONDS.replace(
+            {(self._tenant(token),): max(0.0, now - oldest) for token, (_, oldest) in depths.items()}
+        )
+        SPOOL_DRAIN_RATE_BYTES.set(self._scheduler.drain_rate or 0)
+        if not self._metrics_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._metrics_file), exist_ok=True)
+            REGISTRY.write_textfile(self._metrics_file)
+        except OSError as exp:
+            self.helper.log_error(f"Can not write metrics to {self._metrics_file} [{exp}]")
 
-    def readDataFromFile(self):
+    @contextmanager
+    def _phase(self, stage: str):
+        """Measure the wall time of a phase, for the metrics and the batch profile"""
+        started = time.perf_counter()
         try:
-            filePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", self.config['opencti']['token'])
-            if not os.path.exists(filePath):
-                f = open(filePath, "w+")
-                f.close()
-            dataFile = open(filePath, "r+")
-            if os.path.getsize(filePath) == 0:
-                return [], None
-            dataArray = json.loads(dataFile.read())
-            dataFile.seek(0)
-            dataFile.truncate()
-            return dataArray, None
-        except Exception as exp:
-            raise exp
-            self.helper.log_error(f"Can not open file! [{exp}]")
-            return None, exp
+            yield
         finally:
-            dataFile.close()
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.observe(elapsed, stage=stage)
+            self._profiler.add(stage, elapsed)
 
-    def _create_observation_relationships(
-        self,
-        target: Observation,
-        source: Observation,
-        description: str,
-        label: list,
-        score: int,
-    ) -> Iterator[stix2.Relationship]:
-        """
-        Create relationships between two observations
-        :param target: The target observation
-        :param source: The source Observation
-        :param description: Description of the relationship
-        :param label: Label of the relationship
-        :return: Any relationships created
+    @staticmethod
+    def _tenant(token: str) -> str:
+        """Fingerprint of a tenant token, safe to show in logs and in OpenCTI"""
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+
+    def _process_batch(self, batch: TenantBatch) -> None:
+        """Send the records of one tenant, setting poison records aside
+
+        Until a batch has failed ``max_attempts`` times it is sent whole. Then,
+        if OpenCTI and RabbitMQ are up, it is bisected to find the records that
+        fail on their own, which go to the dead-letter file of the tenant while
+        the others are sent. Only the classification and building of the
+        objects can fail for a record: a failed send, or a send path found down
+        when both halves of a split fail, stops the bisection and the batch is
+        kept for a later retry.
+        :param batch: Records read from the spool of the tenant
         """
-        if source.observable and target.observable:
-            yield self._create_relationship(
-                rel_type="related-to",
-                source_id=source.observable.id,
-                target_id=target.observable.id,
-                description=description,
-                label=label,
-                score=score,
+        tenant = self._tenant(batch.token)
+        if self._scheduler.attempts(batch.token) < self._max_attempts:
+            self._send_records(tenant, batch.records)
+            return
+        self._check_send_path()
+        poison = []
+        self._send_bisecting(tenant, batch.records, poison, [])
+        if poison:
+            self._dead_letters.write(tenant, poison)
+            RECORDS_DEAD_LETTERED.inc(len(poison))
+            self.helper.log_error(
+                f"Moved {len(poison)} records of tenant {tenant} to {self._dead_letters.path(tenant)}"
             )
 
-        if source.indicator and target.indicator:
-            yield self._create_relationship(
-                rel_type="related-to",
-                source_id=source.indicator.id,
-                target_id=target.indicator.id,
-                description=description,
-                label=label,
-                score=score,
-            )
+    def _check_send_path(self) -> None:
+        """Make sure bundles can be sent, raises if OpenCTI or its RabbitMQ is down"""
+        if not self.helper.api.health_check():
+            raise RuntimeError("OpenCTI API is not reachable")
+        connection = getattr(self.helper, "config", {}).get("connection")
+        if connection is None:
+            return
+        try:
+            pika.BlockingConnection(
+                pika.ConnectionParameters(
+                    host=connection["host"],
+                    port=connection["port"],
+                    virtual_host=connection["vhost"],
+                    credentials=pika.PlainCredentials(connection["user"], connection["pass"]),
+                    ssl_options=pika.SSLOptions(create_ssl_context(), connection["host"])
+                    if connection["use_ssl"]
+                    else None,
+                )
+            ).close()
+        except pika.exceptions.AMQPError as exp:
+            raise RuntimeError(f"RabbitMQ is not reachable [{exp}]") from exp
 
-    def _create_indicator(
-        self,
-        value: str,
-        pattern: IndicatorPattern,
-        description: str,
-        label: list,
-        score: int,
-    ) -> stix2.Indicator:
-        """Create an indicator
-        :param value: Observable value
-        :param pattern: Indicator pattern
-        :param description: Description
-        :param label: Label of the relationship
-        :return: An indicator
+    def _send_bisecting(self, tenant: str, records: list, poison: list, works: list) -> bool:
+        """Send records, bisecting them to set aside the ones that fail on their own
+        :return: True if every record was sent
         """
-        return stix2.Indicator(
-            pattern_type="stix",
-            pattern=pattern.pattern,
-            name=value,
-            description=description,
-            labels=label,
-            confidence=score,
-            object_marking_refs=[self._default_tlp],
-            custom_properties=dict(
-                x_opencti_score=score,
-                x_opencti_main_observable_type=pattern.main_observable_type,
-            ),
+        try:
+            self._send_records(tenant, records, works)
+            return True
+        except SendError:
+            raise
+        except Exception as exp:
+            if len(records) == 1:
+                poison.append((records[0], str(exp)))
+                return False
+            middle = len(records) // 2
+            first = self._send_bisecting(tenant, records[:middle], poison, works)
+            second = self._send_bisecting(tenant, records[middle:], poison, works)
+            # Poison records on both sides, or a failure that is not theirs
+            if not first and not second:
+                self._check_send_path()
+            return False
+
+    def _send_records(self, tenant: str, records: list, works: list = None) -> None:
+        """Classify, build and send records of a tenant
+        :param tenant: Fingerprint of the tenant token
+        :param records: Records read from the spool of the tenant
+        :param works: Work of the batch, opened by its first send and reused by the next ones
+        :raises SendError: OpenCTI or its RabbitMQ failed, the records are not at fault
+        """
+        with self._phase("classify"):
+            partitions = self._classify(tenant, records)
+        RECORDS_VALID.inc(sum(len(valid) for valid in partitions[:4]))
+        self._log_rejected(partitions.rejected)
+        with self._phase("build"):
+            bundle_objects = self._create_bundle_objects(partitions)
+        if len(bundle_objects) == 0:
+            if len(records) > 0:
+                self.helper.log_info(f"No objects to bundle for tenant {tenant}")
+            return
+        if works is None:
+            works = []
+        if not works:
+            works.append(self._initiate_work(tenant))
+        work_id = works[0]
+        bundles = iter_bundles(
+            bundle_objects,
+            max_objects=self._bundle_max_objects,
+            max_bytes=self._bundle_max_bytes,
+            serialize=self._builder.serialize,
         )
+        sent = send_bundles(
+            lambda bundle: self._send_bundle(bundle, work_id),
+            self._observe_bundles(bundles),
+        )
+        self._dedupe.commit()
+        self.helper.log_info(
+            f"Sent {len(bundle_objects)} objects in {sent} STIX2 bundles for tenant {tenant}"
+        )
+
+    def _classify(self, tenant: str, records: list) -> Partitions:
+        """Validate and classify records of a tenant
 
-    def _create_domain_observable(
-        self,
-        value: str,
-        description: str,
-        label: list,
-        score: int,
-    ) -> Observation:
-        """Create an observation based on a domain name
-        :param value: Domain name
-        :param description: Description
-        :param label: Label of the relationship
-        :return: An observation
+        Unless disabled, every valid record is labelled ``tenant:<fingerprint>``,
+        so the objects keep, in OpenCTI, which tenants pushed them.
+        :param tenant: Fingerprint of the tenant token
+        :param records: Records read from the spool of the tenant
+        :return: The valid records by kind of value, and the rejected ones with a reason
         """
-        sco = stix2.DomainName(
-            value=value,
-            object_marking_refs=[self._default_tlp],
-            custom_properties=dict(
-                x_opencti_created_by_ref=self._identity["standard_id"],
-                x_opencti_description=description,
-                x_opencti_labels=label,
-                x_opencti_score=score,
-            ),
+        return classify(
+            records,
+            self.helper.connect_confidence_level,
+            extra_labels=[f"tenant:{tenant}"] if self._tenant_label else (),
         )
 
-        sdo = None
-        sro = None
-        if self._create_indicators:
-            pattern = create_indicator_pattern_domain_name(value)
-            sdo = self._create_indicator(
-                value=value,
-                pattern=pattern,
-                description=description,
-                label=label,
-                score=score,
+    def _initiate_work(self, tenant: str) -> str:
+        now = datetime.now(pytz.UTC)
+        friendly_name = f"vncert run for tenant {tenant} @ " + now.astimezone(pytz.UTC).isoformat()
+        try:
+            return self.helper.api.work.initiate_work(
+                self.helper.connect_id, friendly_name
             )
+        except Exception as exp:
+            raise SendError(f"Can not open a work [{exp}]") from exp
 
-            sro = self._create_relationship(
-                rel_type="based-on",
-                source_id=sdo.id,
-                target_id=sco.id,
-                description=description,
-                label=label,
-                score=score,
-            )
+    def _observe_bundles(self, bundles):
+        """Measure the serialization time and the size of each bundle"""
+        bundles = iter(bundles)
+        while True:
+            started = time.perf_counter()
+            bundle = next(bundles, None)
+            if bundle is None:
+                return
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.observe(elapsed, stage="serialize")
+            self._profiler.add("serialize", elapsed)
+            BUNDLE_BYTES.observe(len(bundle.encode("utf-8")))
+            yield bundle
 
-        return Observation(sco, sdo, sro)
+    def _send_bundle(self, bundle: str, work_id: str) -> None:
+        with self._phase("send"):
+            try:
+                self.helper.send_stix2_bundle(
+                    bundle,
+                    work_id=work_id,
+                    update=self._update_existing_data,
+                )
+            except Exception as exp:
+                raise SendError(f"Can not send a bundle [{exp}]") from exp
 
-    def _create_relationship(
-        self,
-        rel_type: str,
-        source_id: str,
-        target_id: str,
-        description: str,
-        label: list,
-        score: int,
-    ) -> stix2.Relationship:
-        """Create a relationship
-        :param rel_type: Relationship type
-        :param source_id: Source ID
-        :param target_id: Target ID
-        :param description: Description
-        :return: A relationship
+    def _log_rejected(self, rejected: List[Rejected]) -> None:
+        """Log and count how many records were rejected, by reason
+        :param rejected: Rejected records of the batch
         """
-        confidence = score
-        created_by_ref = self._identity["standard_id"]
+        for reason, count in Counter(item.reason for item in rejected).items():
+            RECORDS_REJECTED.inc(count, reason=reason)
+            self.helper.log_info(f"Rejected {count} records: {reason}")
 
-        return stix2.Relationship(
-            id=pycti.StixCoreRelationship.generate_id(rel_type, source_id, target_id),
-            source_ref=source_id,
-            relationship_type=rel_type,
-            target_ref=target_id,
-            created_by_ref=created_by_ref,
-            confidence=confidence,
-            description=description,
-            labels=label,
-            object_marking_refs=[self._default_tlp],
-        )
+    def _create_bundle_objects(self, partitions: Partitions) -> list:
+        """Create the STIX2 objects of a classified batch
 
-    def _create_url_observable(
-            self,
-            value: str,
-            description: str,
-            label: list,
-            score: int,
-        ) -> Observation:
-            """Create an observation based on a URL
-            :param value: URL value
-            :param description: Description
-            :return: An observation
-            """
-            sco = stix2.URL(
-                value=value,
-                object_marking_refs=[self._default_tlp],
-                custom_properties=dict(
-                    x_opencti_created_by_ref=self._identity["standard_id"],
-                    x_opencti_description=description,
-                    x_opencti_labels=label,
-                    x_opencti_score=score,
-                ),
+        Objects already in the batch, or sent recently from an identical
+        record, are skipped. Large batches are built by the worker processes
+        of the parallel builder, if enabled.
+        :param partitions: Valid records of the batch, by kind of value
+        :return: Objects to bundle, or serialized objects, in sending order
+        """
+        self._dedupe.start_batch()
+        size = sum(len(records) for records in partitions[:4])
+        if self._parallel_builder is not None and size >= self._parallel_threshold:
+            built = self._parallel_builder.build(partitions)
+        else:
+            built = (
+                (obj["id"], digest, obj)
+                for obj, digest in build_objects(self._builder, partitions)
             )
-            sdo = None
-            sro = None
-            if self._create_indicators:
-                pattern = create_indicator_pattern_url(value)
-                sdo = self._create_indicator(
-                    value=value,
-                    pattern=pattern,
-                    description=description,
-                    label=label,
-                    score=score,
-                )
+        bundle_objects = []
+        count = 0
+        for stix_id, digest, obj in built:
+            count += 1
+            if self._dedupe.is_new(stix_id, digest):
+                bundle_objects.append(obj)
+        OBJECTS_BUILT.inc(count)
+        OBJECTS_DEDUPLICATED.inc(count - len(bundle_objects))
+        return bundle_objects
 
-                sro = self._create_relationship(
-                    rel_type="based-on",
-                    source_id=sdo.id,
-                    target_id=sco.id,
-                    description=description,
-                    label=label,
-                    score=score,
-                )
-
-            return Observation(sco, sdo, sro)
+    def readDataFromFile(self):
+        try:
+            with STAGE_SECONDS.time(stage="read"):
+                batches = self._scheduler.next_round()
+            for batch in batches:
+                RECORDS_READ.inc(len(batch.records))
+                RECORDS_REJECTED.inc(len(batch.errors), reason="unreadable")
+                for err in batch.errors:
+                    self.helper.log_error(f"Skipping unreadable spool record [{err}]")
+            return batches, None
+        except Exception as exp:
+            self.helper.log_error(f"Can not open file! [{exp}]")
+            return None, exp
 
 if __name__ == "__main__":
     try:
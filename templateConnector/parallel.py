@@ -0,0 +1,81 @@
+"""Multi-process construction of the objects of large batches
+
+The classified records of a batch are sharded across a pool of worker
+processes, each building and serializing the objects of its shard. Records
+are sharded by host (or by value), so the observation of a domain shared by
+many URLs is still built once per batch, and IP records are deduplicated by
+canonical value before sharding. The parent process
+only merges the serialized objects and deduplicates them by id.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+from builder import StixBuilder, build_objects, unique_addresses, url_host
+from classifier import Partitions
+
+__all__ = [
+    "shard_partitions",
+    "ParallelBuilder",
+]
+
+SHARDS_PER_WORKER = 2
+
+_worker_builder = None
+
+
+def _init_worker(builder: StixBuilder) -> None:
+    global _worker_builder
+    _worker_builder = builder
+
+
+def _build_shard(shard: Partitions) -> List[Tuple[str, str, str]]:
+    return [
+        (obj["id"], digest, _worker_builder.serialize(obj))
+        for obj, digest in build_objects(_worker_builder, shard)
+    ]
+
+
+def shard_partitions(partitions: Partitions, count: int) -> List[Partitions]:
+    """Split classified records into shards
+    :param partitions: Valid records of the batch, by kind of value
+    :param count: Number of shards
+    :return: Shards, records sharing a host or value are in the same shard
+    """
+    shards = [Partitions([], [], [], [], []) for _ in range(count)]
+    for record in partitions.url:
+        shards[hash(url_host(record)) % count].url.append(record)
+    for record in partitions.domain:
+        shards[hash(record.value) % count].domain.append(record)
+    for version, field in ((4, "ipv4"), (6, "ipv6")):
+        for record in unique_addresses(getattr(partitions, field), version):
+            getattr(shards[hash(record.value) % count], field).append(record)
+    return [shard for shard in shards if any(shard[:4])]
+
+
+class ParallelBuilder:
+    """Pool of worker processes building the objects of large batches"""
+
+    def __init__(self, builder: StixBuilder, workers: int):
+        """
+        :param builder: Builder copied into every worker process
+        :param workers: Number of worker processes
+        """
+        self._workers = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(builder,),
+        )
+
+    def build(self, partitions: Partitions) -> Iterator[Tuple[str, str, str]]:
+        """Build and serialize the objects of a batch in the worker processes
+        :param partitions: Valid records of the batch, by kind of value
+        :return: Id, record fingerprint and serialized form of each object
+        """
+        shards = shard_partitions(partitions, self._workers * SHARDS_PER_WORKER)
+        for objects in self._executor.map(_build_shard, shards):
+            yield from objects
+
+    def close(self) -> None:
+        self._executor.shutdown()
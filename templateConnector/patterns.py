@@ -1,6 +1,14 @@
-"""STIX2 indicator pattern factories"""
+"""STIX2 indicator pattern factories
+
+Patterns are built from a string template that escapes the value the same
+way as the stix2 pattern classes, and memoized in a bounded LRU keyed by
+object type and value, since the same hostname is often seen thousands of
+times. Values that stix2 would not render as a plain string constant fall
+back to the stix2 pattern classes.
+"""
 
 from enum import Enum
+from functools import lru_cache
 from typing import List, NamedTuple, Union
 
 from stix2 import EqualityComparisonExpression, ObjectPath, ObservationExpression
@@ -11,8 +19,19 @@ __all__ = [
     "create_indicator_pattern_ipv4_address",
     "create_indicator_pattern_ipv6_address",
     "IndicatorPattern",
+    "PATTERN_CACHE_SIZE",
 ]
 
+PATTERN_CACHE_SIZE = 65536
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def _quote_if_needed(name: str) -> str:
+    return f"'{name}'" if "-" in name and not name.startswith("'") else name
+
 
 class _ObjectTypeData(NamedTuple):
     object_type: str
@@ -29,6 +48,17 @@ class _ObjectTypeData(NamedTuple):
         oe = ObservationExpression(str(ece))
         return str(oe)
 
+    def create_pattern_fast(self, value: Union[str, int]) -> str:
+        """Create the same pattern as create_pattern without the stix2 pattern classes
+        :param value: Property path value
+        :return: A STIX2 compliant Indicator pattern
+        """
+        # stix2 renders other types, and timestamp strings, as other constants
+        if type(value) != str or (value[-1:] == "Z" and "T" in value):
+            return self.create_pattern(value)
+        path = ".".join(_quote_if_needed(name) for name in self.property_path)
+        return f"[{self.object_type}:{path} = '{_escape(value)}']"
+
 
 class _ObjectType(_ObjectTypeData, Enum):
     IPv4 = ("ipv4-addr", "IPv4-Addr", ["value"])
@@ -45,7 +75,7 @@ class IndicatorPattern(NamedTuple):
 
 
 def _create_indicator_pattern(
-    type_data: _ObjectTypeData,
+    type_data: _ObjectType,
     value: Union[str, int],
 ) -> IndicatorPattern:
     """
@@ -53,8 +83,17 @@ def _create_indicator_pattern(
     :param value: Property path value
     :return: A STIX2 complaint Indicator pattern and observable type
     """
+    return _create_cached_indicator_pattern(type_data.name, value)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _create_cached_indicator_pattern(
+    type_name: str,
+    value: Union[str, int],
+) -> IndicatorPattern:
+    type_data = _ObjectType[type_name]
     return IndicatorPattern(
-        pattern=type_data.create_pattern(value),
+        pattern=type_data.create_pattern_fast(value),
         main_observable_type=type_data.main_observable_type,
     )
 
@@ -0,0 +1,117 @@
+"""Opt-in profiling of the batches processed by the connector
+
+When enabled, every batch records the wall time of its phases (classify,
+build, serialize, send), and every Nth batch is also run under cProfile.
+Its statistics are dumped in the pstats format, named after the time, the
+tenant and the number of records of the batch, for ``python -m pstats``,
+snakeviz or flameprof. Only the thread of the connector loop is profiled:
+the sends run in a worker thread, and show up as waits on their result.
+
+While disabled, a batch costs a counter check and phases are not recorded.
+"""
+
+import cProfile
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+__all__ = [
+    "BatchProfile",
+    "BatchProfiler",
+]
+
+
+class BatchProfile:
+    """Phase times of one batch, and the file of its profile if it was profiled"""
+
+    def __init__(self, tenant: str, records: int):
+        self.tenant = tenant
+        self.records = records
+        self.phases: Dict[str, float] = {}
+        self.seconds = 0.0
+        self.path: Optional[str] = None
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())
+        summary = f"Batch of tenant {self.tenant}: {self.records} records in {self.seconds:.3f}s ({phases})"
+        if self.path is not None:
+            summary += f", profile written to {self.path}"
+        return summary
+
+
+class BatchProfiler:
+    """Phase timing of every batch and cProfile of every Nth one"""
+
+    def __init__(
+        self,
+        directory: str,
+        every: int = 0,
+        keep: int = 100,
+        log: Callable[[str], None] = print,
+    ):
+        """
+        :param directory: Directory of the profile files
+        :param every: Profile one batch out of ``every``, 0 to disable profiling
+        :param keep: Number of profile files kept, the oldest are deleted
+        :param log: Logs the phase times of each batch
+        """
+        self._directory = directory
+        self._every = every
+        self._keep = keep
+        self._log = log
+        self._count = 0
+        self._current: Optional[BatchProfile] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._every > 0
+
+    @contextmanager
+    def batch(self, tenant: str, records: int) -> Iterator[Optional[BatchProfile]]:
+        """Time the phases of a batch, and profile it if it is the Nth one
+
+        Once the block exits, even on an error, the phase times are logged.
+        :param tenant: Fingerprint of the tenant token
+        :param records: Number of records of the batch
+        :return: The profile of the batch, complete once the block exits, None while disabled
+        """
+        if not self._every:
+            yield None
+            return
+        self._count += 1
+        current = self._current = BatchProfile(tenant, records)
+        profile = cProfile.Profile() if self._count % self._every == 0 else None
+        started = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield current
+        finally:
+            if profile is not None:
+                profile.disable()
+            current.seconds = time.perf_counter() - started
+            self._current = None
+            if profile is not None:
+                try:
+                    current.path = self._dump(profile, current)
+                except OSError as exp:
+                    self._log(f"Can not write the profile of a batch [{exp}]")
+            self._log(current.summary())
+
+    def add(self, phase: str, seconds: float) -> None:
+        """Add the wall time of a phase to the current batch, if any"""
+        if self._current is not None:
+            self._current.phases[phase] = self._current.phases.get(phase, 0.0) + seconds
+
+    def _dump(self, profile: cProfile.Profile, batch: BatchProfile) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{self._count:06d}-{batch.tenant}-{batch.records}records.pstats"
+        path = os.path.join(self._directory, name)
+        profile.dump_stats(path)
+        profiles = sorted(
+            entry.path for entry in os.scandir(self._directory) if entry.name.endswith(".pstats")
+        )
+        for old in profiles[: max(0, len(profiles) - self._keep)]:
+            os.remove(old)
+        return path
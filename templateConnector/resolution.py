@@ -0,0 +1,66 @@
+"""Cache of the entities the connector resolves in OpenCTI at startup
+
+The author identity of every object is created, or found, in OpenCTI when
+the connector starts. Its ids are persisted in ``state/`` and reused by the
+next starts for ``ttl`` seconds, so a restart does not wait on OpenCTI for
+them. An expired entry is resolved again, and still used if OpenCTI cannot
+be reached.
+"""
+
+import json
+import os
+import time
+from typing import Callable, Dict
+
+__all__ = [
+    "ResolutionCache",
+]
+
+
+class ResolutionCache:
+    """Persisted ids of entities resolved in OpenCTI, by key"""
+
+    def __init__(self, path: str, ttl: int = 7 * 86400):
+        """
+        :param path: File persisting the cache
+        :param ttl: Seconds a resolved entity is reused without asking OpenCTI again, 0 to always ask
+        """
+        self._path = path
+        self._ttl = ttl
+        self._entries: Dict[str, dict] = self._load()
+
+    def get(self, key: str, resolve: Callable[[], Dict[str, str]]) -> Dict[str, str]:
+        """Get the ids of an entity, resolving them if they are not cached or expired
+        :param key: Identifies the entity, and the platform it is resolved in
+        :param resolve: Resolves the entity in OpenCTI, returns its ids
+        :return: The ids of the entity
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry["resolved"] + self._ttl > time.time():
+            return entry["value"]
+        try:
+            value = resolve()
+        except Exception:
+            if entry is None:
+                raise
+            return entry["value"]
+        self._entries[key] = {"value": value, "resolved": time.time()}
+        self._save()
+        return value
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self._path, "r", encoding="utf-8") as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as cache_file:
+            json.dump(self._entries, cache_file)
+            cache_file.flush()
+            os.fsync(cache_file.fileno())
+        os.replace(temporary_path, self._path)
@@ -0,0 +1,251 @@
+"""Fair draining of the spools of every tenant
+
+The push API spools the records of each bearer token in its own file
+(``data/<token>``). The scheduler discovers every spool of the directory,
+claims their active files and hands out their segments in rounds. In each
+round every tenant with a backlog gets a batch of whole segments bounded by
+its byte budget, so a tenant pushing much more than the others is drained
+over several rounds instead of delaying them. The order of the tenants
+rotates from one round to the next.
+
+Segments are only deleted once their batch is acknowledged, after it was
+sent, so a batch that fails, or is interrupted by a crash, is read again in
+a later round or after a restart. A tenant whose batch failed is skipped
+until its retry time, which backs off exponentially with its consecutive
+failures.
+
+The scheduler also measures how fast it drains the directory and publishes
+the rate in ``.drain`` there, from which the push API computes how long an
+overloaded pusher should wait before retrying.
+"""
+
+import json
+import os
+import re
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+from spool import (
+    CLAIMED_SUFFIX,
+    SpoolDecodeError,
+    claim,
+    claimed_segments,
+    read_segment,
+    split_segment,
+)
+
+__all__ = [
+    "TenantBatch",
+    "SpoolScheduler",
+]
+
+DRAIN_FILE = ".drain"
+DRAIN_SMOOTHING = 0.3
+
+_ACTIVE_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+_SEGMENT_RE = re.compile(
+    r"^([A-Za-z0-9_-]+)\.\d+(?:\.\d+)?" + re.escape(CLAIMED_SUFFIX) + "$"
+)
+
+
+class TenantBatch(NamedTuple):
+    token: str
+    records: List[dict]
+    segments: List[str]
+    errors: List[SpoolDecodeError]
+
+
+class SpoolScheduler:
+    """Round-based scheduler over the spools of a directory"""
+
+    def __init__(
+        self,
+        directory: str,
+        budget_bytes: int = 4 * 1024 * 1024,
+        segment_max_bytes: int = 1024 * 1024,
+        weighted: bool = False,
+        retry_base: float = 5,
+        retry_max: float = 300,
+    ):
+        """
+        :param directory: Directory of the spool files
+        :param budget_bytes: Bytes of segments given to a tenant in a round
+        :param segment_max_bytes: Size above which a claimed segment is split, 0 to never split
+        :param weighted: Share the budget of a round in proportion to the backlog of each tenant
+        :param retry_base: Seconds before retrying the batch of a tenant after its first failure
+        :param retry_max: Maximum seconds between two attempts
+        """
+        self._directory = directory
+        self._budget_bytes = budget_bytes
+        self._segment_max_bytes = segment_max_bytes
+        self._weighted = weighted
+        self._round = 0
+        self._round_bytes = 0
+        self._round_started = None
+        self._drain_rate = None
+        self._retry_base = retry_base
+        self._retry_max = retry_max
+        self._retries: Dict[str, Tuple[int, float]] = {}
+
+    def _waiting(self, token: str) -> bool:
+        retry = self._retries.get(token)
+        return retry is not None and retry[1] > time.monotonic()
+
+    def _tenants(self) -> List[str]:
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return []
+        tenants = set()
+        for name in names:
+            if _ACTIVE_RE.match(name):
+                tenants.add(name)
+                continue
+            match = _SEGMENT_RE.match(name)
+            if match:
+                tenants.add(match.group(1))
+        return sorted(tenants)
+
+    def _backlog(self, token: str) -> List[str]:
+        path = os.path.join(self._directory, token)
+        claim(path)
+        segments = []
+        for segment in claimed_segments(path):
+            segments.extend(split_segment(segment, self._segment_max_bytes))
+        return segments
+
+    def _budgets(self, backlogs: Dict[str, int]) -> Dict[str, int]:
+        if not self._weighted:
+            return {token: self._budget_bytes for token in backlogs}
+        total_budget = self._budget_bytes * len(backlogs)
+        total_backlog = sum(backlogs.values()) or 1
+        return {
+            token: total_budget * size // total_backlog
+            for token, size in backlogs.items()
+        }
+
+    def _update_drain_rate(self) -> None:
+        now = time.monotonic()
+        if self._round_bytes and self._round_started is not None:
+            rate = self._round_bytes / max(now - self._round_started, 0.001)
+            if self._drain_rate is None:
+                self._drain_rate = rate
+            else:
+                self._drain_rate += DRAIN_SMOOTHING * (rate - self._drain_rate)
+            self._write_drain_rate()
+        self._round_bytes = 0
+        self._round_started = now
+
+    def _write_drain_rate(self) -> None:
+        path = os.path.join(self._directory, DRAIN_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as drain_file:
+            json.dump({"bytes_per_second": self._drain_rate, "updated": time.time()}, drain_file)
+        os.replace(path + ".tmp", path)
+
+    @property
+    def drain_rate(self):
+        """Smoothed bytes of spool processed per second, None until measured"""
+        return self._drain_rate
+
+    def next_round(self) -> List[TenantBatch]:
+        """Claim the pending spools and read the next batch of every tenant
+        :return: One batch per tenant with a backlog, in the order of the round
+        """
+        # The previous round was processed in the time since it was read
+        self._update_drain_rate()
+        segments = {}
+        sizes = {}
+        for token in self._tenants():
+            if self._waiting(token):
+                continue
+            backlog = [
+                (segment, os.path.getsize(segment)) for segment in self._backlog(token)
+            ]
+            if backlog:
+                segments[token] = backlog
+                sizes[token] = sum(size for _, size in backlog)
+        if not segments:
+            return []
+        budgets = self._budgets(sizes)
+        tokens = sorted(segments)
+        start = self._round % len(tokens)
+        self._round += 1
+        batches = []
+        for token in tokens[start:] + tokens[:start]:
+            taken = []
+            taken_bytes = 0
+            for segment, size in segments[token]:
+                if taken and taken_bytes + size > budgets[token]:
+                    break
+                taken.append(segment)
+                taken_bytes += size
+            records = []
+            errors = []
+            for segment in taken:
+                records.extend(read_segment(segment, errors))
+            self._round_bytes += taken_bytes
+            batches.append(TenantBatch(token, records, taken, errors))
+        return batches
+
+    def ack(self, batch: TenantBatch) -> None:
+        """Delete the segments of a batch once its records are processed
+        :param batch: Batch returned by ``next_round``
+        """
+        for segment in batch.segments:
+            try:
+                os.remove(segment)
+            except FileNotFoundError:
+                pass
+        self._retries.pop(batch.token, None)
+
+    def fail(self, batch: TenantBatch) -> Tuple[int, float]:
+        """Keep the segments of a batch that failed, to retry it later
+        :param batch: Batch returned by ``next_round``
+        :return: Number of consecutive failures of the tenant and seconds before its next attempt
+        """
+        attempts = self.attempts(batch.token) + 1
+        delay = min(self._retry_base * 2 ** (attempts - 1), self._retry_max)
+        self._retries[batch.token] = (attempts, time.monotonic() + delay)
+        return attempts, delay
+
+    def attempts(self, token: str) -> int:
+        """Number of consecutive failures of the batches of a tenant"""
+        retry = self._retries.get(token)
+        return retry[0] if retry is not None else 0
+
+    def depths(self) -> Dict[str, Tuple[int, float]]:
+        """Backlog of every tenant, active file included
+        :return: Bytes waiting and modification time of the oldest file, by token
+        """
+        try:
+            entries = list(os.scandir(self._directory))
+        except FileNotFoundError:
+            return {}
+        depths = {}
+        for entry in entries:
+            match = _SEGMENT_RE.match(entry.name)
+            if match:
+                token = match.group(1)
+            elif _ACTIVE_RE.match(entry.name):
+                token = entry.name
+            else:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            size, oldest = depths.get(token, (0, stat.st_mtime))
+            depths[token] = (size + stat.st_size, min(oldest, stat.st_mtime))
+        return depths
+
+    def has_backlog(self) -> bool:
+        """Check whether claimed segments are still waiting for a round"""
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return False
+        for name in names:
+            match = _SEGMENT_RE.match(name)
+            if match and not self._waiting(match.group(1)):
+                return True
+        return False
@@ -0,0 +1,181 @@
+"""Reader for the NDJSON spool filled by the push API
+
+The API appends one JSON record per line. Spool files written before the
+switch to NDJSON hold a single JSON array instead, so a line may also carry
+an array (or several concatenated documents); every record found is yielded.
+
+The active spool is never read in place. It is atomically renamed to a
+claimed segment (``<token>.<time_ns>.claimed``) and the API starts a fresh
+active file on its next push. Taking an exclusive ``flock`` on the segment
+waits for the pushes that were already appending to it, so the segment is
+complete once claimed. Segments left behind by a crash are picked up again
+by the next claim. Large segments can be split, at line boundaries, into
+parts (``<token>.<time_ns>.<part>.claimed``) that are read one at a time.
+"""
+
+import fcntl
+import glob
+import json
+import os
+import time
+from typing import IO, Iterator, List, Optional, Tuple
+
+__all__ = [
+    "CLAIMED_SUFFIX",
+    "claim",
+    "claimed_segments",
+    "claim_segments",
+    "iter_records",
+    "read_segment",
+    "split_segment",
+    "SpoolDecodeError",
+]
+
+CLAIMED_SUFFIX = ".claimed"
+
+_decoder = json.JSONDecoder()
+
+
+class SpoolDecodeError(ValueError):
+    """A spool line could not be decoded"""
+
+    def __init__(self, line_number: int, line: str, reason: str):
+        super().__init__(f"line {line_number}: {reason}")
+        self.line_number = line_number
+        self.line = line
+
+
+def _decode_line(line: str) -> List[dict]:
+    records = []
+    index = 0
+    end = len(line)
+    while index < end:
+        document, index = _decoder.raw_decode(line, index)
+        if isinstance(document, list):
+            records.extend(document)
+        else:
+            records.append(document)
+        while index < end and line[index].isspace():
+            index += 1
+    return records
+
+
+def iter_records(spool: IO[bytes], errors: List[SpoolDecodeError] = None) -> Iterator[dict]:
+    """Iterate over the records of a spool, line by line
+
+    Lines are decoded from UTF-8 one at a time, so an invalid byte only
+    costs its own line.
+    :param spool: Spool file opened in binary mode
+    :param errors: Collects the lines that could not be decoded, if given
+    :return: The decoded records
+    """
+    for line_number, raw_line in enumerate(spool, 1):
+        raw_line = raw_line.strip()
+        if not raw_line:
+            continue
+        try:
+            line = raw_line.decode("utf-8") if isinstance(raw_line, bytes) else raw_line
+            records = _decode_line(line)
+        except ValueError as exp:
+            # UnicodeDecodeError is a ValueError too
+            if errors is not None:
+                if isinstance(raw_line, bytes):
+                    raw_line = raw_line.decode("utf-8", "replace")
+                errors.append(SpoolDecodeError(line_number, raw_line, str(exp)))
+            continue
+        yield from records
+
+
+def _segment_sequence(segment: str) -> Tuple[int, ...]:
+    name = os.path.basename(segment)[: -len(CLAIMED_SUFFIX)]
+    return tuple(int(number) for number in name.split(".")[1:])
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def claimed_segments(path: str) -> List[str]:
+    """List the claimed segments of a spool, oldest first
+    :param path: Path of the active spool file
+    :return: Paths of the claimed segments
+    """
+    segments = glob.glob(glob.escape(path) + ".*" + CLAIMED_SUFFIX)
+    return sorted(segments, key=_segment_sequence)
+
+
+def claim(path: str) -> Optional[str]:
+    """Claim the active spool file as a new segment
+    :param path: Path of the active spool file
+    :return: Path of the claimed segment, None if there was nothing to claim
+    """
+    segment = f"{path}.{time.time_ns()}{CLAIMED_SUFFIX}"
+    try:
+        os.rename(path, segment)
+    except FileNotFoundError:
+        return None
+    _fsync_dir(os.path.dirname(segment))
+    with open(segment, "rb") as segment_file:
+        # Wait for the writers that were appending when we renamed the file
+        fcntl.flock(segment_file, fcntl.LOCK_EX)
+    return segment
+
+
+def claim_segments(path: str) -> List[str]:
+    """Claim the active spool file and list every segment left to read
+    :param path: Path of the active spool file
+    :return: Paths of the claimed segments, oldest first
+    """
+    claim(path)
+    return claimed_segments(path)
+
+
+def read_segment(segment: str, errors: List[SpoolDecodeError] = None) -> Iterator[dict]:
+    """Iterate over the records of a claimed segment
+    :param segment: Path of the claimed segment
+    :param errors: Collects the lines that could not be decoded, if given
+    :return: The decoded records
+    """
+    with open(segment, "rb") as spool:
+        yield from iter_records(spool, errors)
+
+
+def split_segment(segment: str, max_bytes: int) -> List[str]:
+    """Split a claimed segment into parts of about ``max_bytes``
+    :param segment: Path of the claimed segment
+    :param max_bytes: Size above which a segment is split
+    :return: Paths of the parts, or of the segment itself if it is small enough
+    """
+    if (
+        max_bytes <= 0
+        or os.path.basename(segment).count(".") > 2
+        or os.path.getsize(segment) <= max_bytes
+    ):
+        return [segment]
+    prefix = segment[: -len(CLAIMED_SUFFIX)]
+    parts = []
+    part_file = None
+    part_bytes = 0
+    try:
+        with open(segment, "rb") as segment_file:
+            for line in segment_file:
+                if part_file is None or part_bytes >= max_bytes:
+                    if part_file is not None:
+                        part_file.close()
+                    parts.append(f"{prefix}.{len(parts)}{CLAIMED_SUFFIX}")
+                    part_file = open(parts[-1] + ".tmp", "wb")
+                    part_bytes = 0
+                part_file.write(line)
+                part_bytes += len(line)
+    finally:
+        if part_file is not None:
+            part_file.close()
+    for part in parts:
+        os.rename(part + ".tmp", part)
+    _fsync_dir(os.path.dirname(segment))
+    os.remove(segment)
+    return parts
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+import stix2
+
+from builder import FastStixBuilder, StixBuilder, build_objects
+from classifier import classify
+
+IDENTITY_ID = "identity--5e3cba38-fad2-5ea4-9cf8-1e738845aa22"
+TIMESTAMPS = ("created", "modified", "valid_from")
+
+RECORDS = [
+    {"value": "http://example.com/path", "description": "Demo data", "label": ["Bạo lực"], "score": 80},
+    {"value": "https://example.com/other", "description": "Demo data", "label": ["Bạo lực"]},
+    {"value": "http://10.1.2.3/x", "description": "", "label": []},
+    {"value": "http://[2001:db8::1]/x", "label": ["Cờ bạc", "Tình dục"]},
+    {"value": "example.org", "description": "it's \\ quoted", "label": ["Chất kích thích"]},
+    {"value": "10.0.0.5", "label": []},
+    {"value": "10.0.0.0/8", "description": "network", "label": ["Vũ khí nguy hiểm"], "score": 0},
+    {"value": "2001:db8::2", "description": "", "label": ["Bạo lực"]},
+    {"value": "2001:db8::/32", "label": []},
+    {"value": "sub.example.vn", "description": "đường dẫn", "label": ["Bạo lực"]},
+]
+
+
+def _build(builder_class, create_indicators):
+    builder = builder_class(IDENTITY_ID, stix2.TLP_WHITE, create_indicators=create_indicators)
+    partitions = classify(RECORDS, 50)
+    assert not partitions.rejected
+    return builder, [(builder.serialize(obj), digest) for obj, digest in build_objects(builder, partitions)]
+
+
+def _without_timestamps(serialized):
+    obj = json.loads(serialized)
+    for key in TIMESTAMPS:
+        obj.pop(key, None)
+    return obj
+
+
+@pytest.mark.parametrize("create_indicators", [True, False])
+def test_fast_builder_matches_stix2(create_indicators):
+    _, expected = _build(StixBuilder, create_indicators)
+    _, built = _build(FastStixBuilder, create_indicators)
+    assert len(built) == len(expected)
+    for (fast, fast_digest), (slow, slow_digest) in zip(built, expected):
+        assert _without_timestamps(fast) == _without_timestamps(slow)
+        assert fast_digest == slow_digest
+
+
+def test_fast_builder_output_parses():
+    _, built = _build(FastStixBuilder, True)
+    types = set()
+    for serialized, _ in built:
+        obj = stix2.parse(serialized, allow_custom=True)
+        types.add(obj["type"])
+    assert types == {"url", "domain-name", "ipv4-addr", "ipv6-addr", "indicator", "relationship"}
+
+
+def test_url_ip_hosts_are_canonical():
+    records = [
+        {"value": "http://[2001:DB8:0::1]/a", "label": ["Bạo lực"]},
+        {"value": "http://[2001:db8::1]/b", "label": ["Bạo lực"]},
+        {"value": "2001:0db8::0001", "label": ["Bạo lực"]},
+    ]
+    builder = FastStixBuilder(IDENTITY_ID, stix2.TLP_WHITE, create_indicators=False)
+    objects = [json.loads(builder.serialize(obj)) for obj, _ in build_objects(builder, classify(records, 50))]
+    addresses = [obj for obj in objects if obj["type"] == "ipv6-addr"]
+    assert [obj["value"] for obj in addresses] == ["2001:db8::1"]
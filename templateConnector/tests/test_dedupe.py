@@ -0,0 +1,55 @@
+import json
+import os
+
+from dedupe import DedupeIndex
+
+
+def _commit(index, *entries):
+    index.start_batch()
+    for stix_id, digest in entries:
+        index.is_new(stix_id, digest)
+    index.commit()
+
+
+def test_commit_appends_to_the_log(tmp_path):
+    path = str(tmp_path / "state" / "dedupe.json")
+    index = DedupeIndex(path, capacity=100)
+    _commit(index, ("a", "1"), ("b", "1"))
+    _commit(index, ("c", "1"))
+    assert not os.path.exists(path)
+    with open(path + ".log", encoding="utf-8") as log_file:
+        assert [json.loads(line)[0] for line in log_file] == ["a", "b", "c"]
+
+    restored = DedupeIndex(path, capacity=100)
+    assert not restored.is_new("a", "1")
+    assert not restored.is_new("c", "1")
+    assert restored.is_new("b", "2")
+
+
+def test_log_is_compacted_at_capacity(tmp_path):
+    path = str(tmp_path / "dedupe.json")
+    index = DedupeIndex(path, capacity=4)
+    _commit(index, ("a", "1"), ("b", "1"))
+    _commit(index, ("c", "1"), ("d", "1"))
+    assert os.path.getsize(path + ".log") == 0
+    with open(path, encoding="utf-8") as snapshot:
+        assert [entry[0] for entry in json.load(snapshot)] == ["a", "b", "c", "d"]
+    _commit(index, ("e", "1"))
+
+    restored = DedupeIndex(path, capacity=4)
+    assert restored.is_new("a", "1")
+    for stix_id in "bcde":
+        assert not restored.is_new(stix_id, "1")
+
+
+def test_torn_log_line_is_skipped(tmp_path):
+    path = str(tmp_path / "dedupe.json")
+    index = DedupeIndex(path, capacity=100)
+    _commit(index, ("a", "1"))
+    with open(path + ".log", "a", encoding="utf-8") as log_file:
+        log_file.write('["b","1",')
+    restored = DedupeIndex(path, capacity=100)
+    assert not restored.is_new("a", "1")
+    assert restored.is_new("b", "1")
+    _commit(restored, ("c", "1"))
+    assert not DedupeIndex(path, capacity=100).is_new("c", "1")
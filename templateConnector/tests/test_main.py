@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from bench import StandInHelper
+from main import Connector, SendError
+from scheduler import TenantBatch
+
+
+class Helper(StandInHelper):
+    def __init__(self, send_fails=False):
+        super().__init__()
+        self.send_fails = send_fails
+        self.works = 0
+        self.bundles = []
+        self.api.work.initiate_work = self._initiate_work
+
+    def _initiate_work(self, connector_id, friendly_name):
+        self.works += 1
+        return f"work_{self.works}"
+
+    def send_stix2_bundle(self, bundle, **kwargs):
+        if self.send_fails:
+            raise ConnectionError("RabbitMQ is down")
+        self.bundles.append(bundle)
+        return super().send_stix2_bundle(bundle, **kwargs)
+
+
+def _records(count, poison=()):
+    return [
+        {"value": "poison.com" if index in poison else f"host{index}.com", "label": ["Bạo lực"]}
+        for index in range(count)
+    ]
+
+
+def _bisecting(helper, tmp_path, records):
+    (tmp_path / "data").mkdir()
+    connector = Connector(helper, str(tmp_path))
+    batch = TenantBatch("token", records, [], [])
+    for _ in range(connector._max_attempts):
+        connector._scheduler.fail(batch)
+    return connector, batch
+
+
+def test_failed_send_is_not_bisected(tmp_path):
+    helper = Helper(send_fails=True)
+    connector, batch = _bisecting(helper, tmp_path, _records(200))
+    with pytest.raises(SendError):
+        connector._process_batch(batch)
+    assert helper.works == 1
+    assert not (tmp_path / "state" / "dead-letter").exists()
+
+
+def test_poison_records_are_set_aside(tmp_path, monkeypatch):
+    helper = Helper()
+    connector, batch = _bisecting(helper, tmp_path, _records(200, poison=(3, 150)))
+    create_bundle_objects = connector._create_bundle_objects
+
+    def failing(partitions):
+        if any(record.value == "poison.com" for record in partitions.domain):
+            raise ValueError("poison")
+        return create_bundle_objects(partitions)
+
+    monkeypatch.setattr(connector, "_create_bundle_objects", failing)
+    connector._process_batch(batch)
+    lines = (tmp_path / "state" / "dead-letter").glob("*")
+    dead_letters = "".join(path.read_text(encoding="utf-8") for path in lines)
+    assert dead_letters.count("poison.com") == 2
+    assert helper.works == 1
+
+
+def test_objects_carry_the_tenant_label(tmp_path):
+    helper = Helper()
+    (tmp_path / "data").mkdir()
+    connector = Connector(helper, str(tmp_path))
+    connector._process_batch(TenantBatch("token", _records(2), [], []))
+    tenant = connector._tenant("token")
+    objects = [obj for bundle in helper.bundles for obj in json.loads(bundle)["objects"]]
+    labelled = [obj for obj in objects if obj["type"] in ("domain-name", "indicator")]
+    assert labelled
+    for obj in labelled:
+        labels = obj.get("labels") or obj.get("x_opencti_labels")
+        assert f"tenant:{tenant}" in labels and "Bạo lực" in labels
@@ -0,0 +1,52 @@
+import pytest
+
+from patterns import (
+    _ObjectType,
+    create_indicator_pattern_domain_name,
+    create_indicator_pattern_ipv4_address,
+    create_indicator_pattern_ipv6_address,
+    create_indicator_pattern_url,
+)
+
+VALUES = [
+    "example.com",
+    "http://example.com/path?query=1&other=2#fragment",
+    "http://example.com/it's",
+    "http://example.com/''double''",
+    "http://example.com/back\\slash",
+    "http://example.com/\\'both\\'",
+    "http://example.com/trailing\\",
+    "2020-01-01T00:00:00Z",
+    "2020-01-01T00:00:00.000Z",
+    "TZ",
+    "Z",
+    "ends-with-Z",
+    "http://ví-dụ.vn/đường-dẫn",
+    "xn--v-dua.vn",
+    "http://例子.测试/路径",
+    "emoji-😀.com",
+    "tab\tand\nnewline",
+    "10.0.0.1",
+    "10.0.0.0/8",
+    "2001:db8::1",
+    "2001:db8::/32",
+]
+
+
+@pytest.mark.parametrize("object_type", list(_ObjectType))
+@pytest.mark.parametrize("value", VALUES)
+def test_fast_pattern_matches_stix2(object_type, value):
+    assert object_type.create_pattern_fast(value) == object_type.create_pattern(value)
+
+
+@pytest.mark.parametrize("create, object_type", [
+    (create_indicator_pattern_url, _ObjectType.Url),
+    (create_indicator_pattern_domain_name, _ObjectType.DomainName),
+    (create_indicator_pattern_ipv4_address, _ObjectType.IPv4),
+    (create_indicator_pattern_ipv6_address, _ObjectType.IPv6),
+])
+def test_factories(create, object_type):
+    for value in VALUES:
+        pattern = create(value)
+        assert pattern.pattern == object_type.create_pattern(value)
+        assert pattern.main_observable_type == object_type.main_observable_type
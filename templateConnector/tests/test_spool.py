@@ -0,0 +1,15 @@
+from spool import read_segment
+
+
+def test_invalid_utf8_only_costs_its_line(tmp_path):
+    segment = tmp_path / "token.1.claimed"
+    segment.write_bytes(
+        '{"value": "a.com"}\n'.encode("utf-8")
+        + b'{"value": "b\xff.com"}\n'
+        + '[{"value": "c.com"}, {"value": "đ.vn"}]\n'.encode("utf-8")
+    )
+    errors = []
+    records = list(read_segment(str(segment), errors))
+    assert [record["value"] for record in records] == ["a.com", "c.com", "đ.vn"]
+    assert [error.line_number for error in errors] == [2]
+    assert errors[0].line == '{"value": "b�.com"}'
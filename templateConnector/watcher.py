@@ -0,0 +1,95 @@
+"""Wait for new data in the spool directory
+
+In ``inotify`` mode the connector sleeps until the API closes a spool file
+it has written to, then waits for a short debounce window so that a burst of
+pushes is drained as one batch. In ``poll`` mode (or when ``inotify_simple``
+is not installed) the spool is polled with a backoff that doubles while the
+spool stays idle and resets as soon as data shows up.
+"""
+
+import time
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+    flags = None
+
+__all__ = [
+    "WATCH_MODES",
+    "SpoolWatcher",
+]
+
+WATCH_MODES = ("auto", "inotify", "poll")
+
+
+class SpoolWatcher:
+    """Block the connector loop until the spool has probably changed"""
+
+    def __init__(
+        self,
+        directory: str,
+        mode: str = "auto",
+        debounce: float = 0.5,
+        min_interval: float = 1,
+        max_interval: float = 10,
+    ):
+        """
+        :param directory: Spool directory to watch
+        :param mode: One of auto, inotify or poll
+        :param debounce: Seconds to keep collecting writes after the first one
+        :param min_interval: Shortest poll interval, in seconds
+        :param max_interval: Longest poll interval, in seconds
+        """
+        if mode not in WATCH_MODES:
+            raise ValueError(f"Invalid watch mode: {mode}")
+        if mode == "inotify" and INotify is None:
+            raise ValueError("Watch mode inotify requires the inotify_simple package")
+        self._debounce = debounce
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._interval = min_interval
+        self._inotify = None
+        if mode != "poll" and INotify is not None:
+            self._inotify = INotify()
+            self._inotify.add_watch(directory, flags.CLOSE_WRITE)
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify is not None else "poll"
+
+    def wait(self, had_data: bool) -> None:
+        """Wait until new data is likely to be in the spool
+        :param had_data: Whether the last cycle found data in the spool
+        """
+        if self._inotify is None:
+            self._poll(had_data)
+        else:
+            self._watch()
+
+    def _poll(self, had_data: bool) -> None:
+        if had_data:
+            self._interval = self._min_interval
+        else:
+            self._interval = min(self._interval * 2, self._max_interval)
+        time.sleep(self._interval)
+
+    def _watch(self) -> None:
+        # The timeout is only a safety net, e.g. for segments left by a crash
+        if not self._read_events(self._max_interval):
+            return
+        if self._debounce > 0:
+            time.sleep(self._debounce)
+            self._read_events(0)
+
+    def _read_events(self, timeout: float) -> bool:
+        events = self._inotify.read(timeout=int(timeout * 1000))
+        # Files written by the connector itself are not new data
+        return any(
+            not event.name.startswith(".") and not event.name.endswith(".tmp")
+            for event in events
+        )
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()